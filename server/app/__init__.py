@@ -1,4 +1,18 @@
 class Task(object):
+    """\
+    A step in the per-frame pipeline
+
+    Tasks communicate through the frame data passed to run().  CONSUMES and PRODUCES
+    list the data keys a task reads and writes - the pipeline builder uses them to
+    order tasks and to find tasks that can run side by side.  A task that consumes
+    something is skipped on frames where none of its consumed keys are present,
+    unless ALWAYS_RUN is set (for tasks with time based work, like effects).
+    """
+
+    CONSUMES = ()
+    PRODUCES = ()
+    ALWAYS_RUN = False
+
     def __init__(self, name, config, *args, **kwargs):
         self.name = name
         self.config = config
@@ -9,6 +23,30 @@ class Task(object):
     def stop(self):
         pass
 
+    def restart(self, data):
+        """Called by the supervisor when the task hangs, to recover it in place"""
+        self.stop()
+        self.start(data)
+
+    def check_config(self, config, keys):
+        """\
+        Called with a reloaded config before it is applied, raises if the task can't use it
+
+        keys is the set of top level keys that changed.  Anything config_changed()
+        would rebuild from those keys should be built here from config, without
+        changing the task.
+        """
+        pass
+
+    def config_changed(self, keys):
+        """Called after the config was reloaded, with the set of top level keys that changed"""
+        pass
+
+    def should_run(self, data):
+        if self.ALWAYS_RUN or not self.CONSUMES:
+            return True
+        return any(k in data for k in self.CONSUMES)
+
     def run(self, data):
         pass
 
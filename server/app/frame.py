@@ -0,0 +1,172 @@
+import numpy as np
+
+from app.lib.fft import fft_size
+
+
+class ChannelBuffer(object):
+    """\
+    Preallocated DMX universe
+
+    Channels are 1-based like in DmxPy.  Only channels set since the last clear() are
+    reported by items(), and the buffer is falsy if nothing was set.
+    """
+
+    __slots__ = ('values', 'changed')
+
+    def __init__(self, size=512):
+        self.values = np.zeros(size + 1, dtype=np.int32)
+        self.changed = np.zeros(size + 1, dtype=bool)
+
+    def __bool__(self):
+        return bool(self.changed.any())
+
+    def set(self, channels, values):
+        self.values[channels] = values
+        self.changed[channels] = True
+
+    def update(self, channels):
+        for chan, val in channels.items():
+            self.values[chan] = val
+            self.changed[chan] = True
+
+    def items(self):
+        channels = np.flatnonzero(self.changed)
+        return zip(channels.tolist(), self.values[channels].tolist())
+
+    def clear(self):
+        self.changed[:] = False
+
+
+class FrameContext(object):
+    """\
+    Data passed between tasks for a single frame
+
+    One context is allocated up front and reset between frames, instead of building a
+    new dict (and new arrays and dicts inside it) on every frame.  Fields are fixed:
+
+    * Scalars are None when not set this frame
+    * Buffers are preallocated arrays - a producer calls buffer(key) to get the array
+      to write into, which also marks the field as set for this frame
+    * Collections (DMX channel buffers and dicts) are cleared in place
+
+    An input catching up with INPUT_POLICY batch hands over several frames of audio
+    at once: it writes them to batch_buffer(k), and processors that keep state across
+    frames read them back through batch().  raw_channels is always the newest frame
+    of the batch.  The analysis of every frame in the batch is kept the same way:
+    spectrum, spectrum_level and mel have one row per frame, and batch(key) returns
+    the rows of this pass.
+
+    Tasks still address fields by the key names they declare in CONSUMES/PRODUCES, so
+    the context supports the usual mapping operations.  A key of the form
+    'collection__name' addresses an entry in a dict collection, eg.
+    'push_state__front_2' is push_state['front_2'].
+    """
+
+    SCALARS = ('capture_time', 'is_onset', 'onset_strength', 'is_beat', 'bpm', 'beat_phase', 'next_beat_time', 'pitch', 'chord', 'key', 'rms_momentary', 'rms_short_term', 'loudness_momentary', 'loudness_short_term', 'audio_v_sum', 'audio_v_avg', 'idle_for', 'dead_for', 'balance', 'batch_size')
+    BUFFERS = ('raw_channels', 'raw_audio', 'spectrum', 'spectrum_level', 'mel', 'audio', 'audio_channels', 'chroma')
+    COLLECTIONS = ('dmx', 'dmx_force', 'push_state', 'gobo_state', 'led_pixels', 'onset', 'onset_time')
+
+    __slots__ = SCALARS + BUFFERS + COLLECTIONS + ('_buffers',)
+
+    def __init__(self, config):
+        channels = config.get('INPUT_CHANNELS', 1)
+        batch = config.get('INPUT_BATCH', 8) if config.get('INPUT_POLICY') == 'batch' else 1
+        block_size = int(config['MIC_RATE'] / config['FPS'])
+        raw_batch = np.zeros((batch, channels, block_size), dtype=np.float32)
+        raw_channels = raw_batch[-1]
+        spectrum_bins = fft_size(block_size, config['N_ROLLING_HISTORY']) // 2 + 1
+        self._buffers = {
+            'raw_batch': raw_batch,
+            'raw_channels': raw_channels,
+            # Mono input doesn't need a downmix, raw_audio is the only channel
+            'raw_audio': raw_channels[0] if channels == 1 else np.zeros(raw_channels.shape[1], dtype=np.float32),
+            'spectrum': np.zeros((batch, channels, spectrum_bins), dtype=np.float32),
+            'spectrum_level': np.zeros(batch),
+            'mel': np.zeros((batch, config['N_FFT_BINS'])),
+            'audio': np.zeros(config['N_FFT_BINS'], dtype=np.float64),
+            'audio_channels': np.zeros((channels, config['N_FFT_BINS']), dtype=np.float64),
+            'chroma': np.zeros(12),
+        }
+        self.dmx = ChannelBuffer()
+        self.dmx_force = ChannelBuffer()
+        self.push_state = {}
+        self.gobo_state = {}
+        self.led_pixels = {}
+        self.onset = {}
+        self.onset_time = {}
+        self.reset()
+
+    def reset(self):
+        for key in self.SCALARS + self.BUFFERS:
+            setattr(self, key, None)
+        for key in self.COLLECTIONS:
+            getattr(self, key).clear()
+
+    def buffer(self, key):
+        buf = self._buffers[key]
+        setattr(self, key, buf)
+        return buf
+
+    def batch_buffer(self, k):
+        """Like buffer('raw_channels'), for k frames at once (oldest first)"""
+        self.batch_size = k
+        self.buffer('raw_channels')
+        return self._buffers['raw_batch'][-k:]
+
+    def batch(self, key='raw_batch'):
+        """\
+        Every frame handed over in this pass, oldest first
+
+        The raw audio (channels x samples each) by default, or the rows of a per
+        frame buffer such as spectrum.
+        """
+        return self._buffers[key][-(self.batch_size or 1):]
+
+    def _resolve(self, key):
+        # Returns (collection, name) for keyed collection entries, (None, key) otherwise
+        if key not in self.__slots__ and '__' in key:
+            field, name = key.split('__', 1)
+            if field in self.COLLECTIONS:
+                return getattr(self, field), name
+        if key not in self.__slots__ or key.startswith('_'):
+            raise KeyError(key)
+        return None, key
+
+    def __contains__(self, key):
+        try:
+            collection, name = self._resolve(key)
+        except KeyError:
+            return False
+        if collection is not None:
+            return name in collection
+        value = getattr(self, name)
+        if name in self.COLLECTIONS:
+            return bool(value)
+        return value is not None
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        collection, name = self._resolve(key)
+        if collection is not None:
+            return collection[name]
+        return getattr(self, name)
+
+    def __setitem__(self, key, value):
+        collection, name = self._resolve(key)
+        if collection is not None:
+            collection[name] = value
+        elif name in self.COLLECTIONS:
+            raise KeyError(f"Can't replace {name}, update it in place")
+        else:
+            setattr(self, name, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
@@ -5,36 +5,131 @@ import logging
 import select
 import re
 import multiprocessing
+from collections import deque
 from multiprocessing.queues import Empty
-from threading import Lock
+from queue import Queue, Full
+from threading import Thread, Event
 import os
 import signal
+import struct
+import wave
+from urllib.parse import urlparse
 
 import numpy as np
 
 from app import Task, NoData
 from app.lib.misc import FPSCounter
+from app.lib.network import send_monitor
+from app.lib.ring import SampleRing, SharedBlockRing
+from app.lib.jitter import JitterBuffer
 
 
 logger = logging.getLogger(__name__)
 
-# Audio libs
-try:
-    import pyaudio
-except ImportError:
-    logger.info("PyAudio is not installed")
-
-try:
-    import alsaaudio
-except ImportError:
-    logger.info("PyAlsaAudio is not installed")
+# The audio libs (pyaudio, alsaaudio) are imported by the inputs that use them, so
+# only the configured input's has to be installed and loaded
 
 
 class Input(Task):
+    """\
+    Base class for audio inputs
+
+    INPUT_CHANNELS sets the number of channels to capture (1 by default).  Inputs
+    write every channel to raw_channels, and call downmix() to fill raw_audio for
+    the processors that work on mono audio.
+
+    INPUT_POLICY decides what happens when the pipeline falls behind the capture
+    device: 'all' (the default) hands over every buffered frame in order, 'latest'
+    skips to the newest complete frame for the lowest latency, and 'batch' hands over
+    up to INPUT_BATCH (8) buffered frames at once, so processors catch up in one pass
+    (see FrameContext.batch).
+
+    Inputs count capture problems and report them to the monitor every
+    report_interval seconds:
+    * overflows - the device or driver lost audio before it was read
+    * underruns - the device delivered less audio than asked for
+    * missed - frames overwritten in the input's buffer before the pipeline got to them
+    * dropped - frames skipped on purpose (INPUT_POLICY latest, realtime file playback)
+    """
+
+    POLICIES = ('all', 'latest', 'batch')
+    COUNTERS = ('overflows', 'underruns', 'missed', 'dropped')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fps = FPSCounter("Audio input: " + self.name)
         self.frames_per_buffer = int(self.config['MIC_RATE'] / self.config['FPS'])
+        self.channels = self.config.get('INPUT_CHANNELS', 1)
+        self.policy = self.config.get('INPUT_POLICY', 'all')
+        if self.policy not in self.POLICIES:
+            raise ValueError(f"Invalid INPUT_POLICY {self.policy}, must be one of {', '.join(self.POLICIES)}")
+        self.batch = self.config.get('INPUT_BATCH', 8) if self.policy == 'batch' else 1
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.reported_counters = dict(self.counters)
+        self.report_interval = 5
+        self.last_report = time.time()
+
+    def downmix(self, data):
+        """Mark raw_audio as set, averaging the channels into it if there is more than one"""
+        mono = data.buffer('raw_audio')
+        if self.channels > 1:
+            np.mean(data['raw_channels'], axis=0, out=mono)
+
+    def read_batch(self, data, pending, read):
+        """\
+        Read up to self.batch of the pending frames into the frame context
+
+        read(out) fills out (samples x channels) with the next frame and returns its
+        capture time, or None if there is nothing left after all.  Sets capture_time
+        to the newest frame's and downmixes it.  Returns the number of frames read.
+        """
+        k = max(1, min(pending, self.batch))
+        batch = data.batch_buffer(k)
+        n = 0
+        while n < k:
+            capture_time = read(batch[n].T)
+            if capture_time is None:
+                break
+            data['capture_time'] = capture_time
+            n += 1
+
+        if not n:
+            data.update({'raw_channels': None, 'batch_size': None})
+        elif n < k:
+            # The newest frame has to be last
+            batch[k - n:] = batch[:n].copy()
+            data.batch_buffer(n)
+        if n:
+            self.downmix(data)
+        return n
+
+    def count(self, key, n=1):
+        self.counters[key] += n
+
+    def report_counters(self, **state):
+        """\
+        Called after each frame, sends the counters to the monitor every report_interval
+
+        Any keyword arguments are sent along with the counters.
+        """
+        now = time.time()
+        if now - self.last_report < self.report_interval:
+            return
+        send_monitor(None, 'INPUT', opname=self.name, policy=self.policy, **dict(state, **self.counters))
+        new = {k: v - self.reported_counters[k] for k, v in self.counters.items() if v != self.reported_counters[k]}
+        if new:
+            logger.warning("Audio input %s in the last %ds: %s", self.name, self.report_interval, ', '.join(f"{v} {k}" for k, v in new.items()))
+        self.reported_counters = dict(self.counters)
+        self.last_report = now
+
+    def wait(self, timeout):
+        """\
+        Block for up to timeout seconds until a frame can be read
+
+        Returns True if a frame is ready.  Inputs that can't block return False, and
+        the frame clock falls back to sleeping until the next period is due.
+        """
+        return False
 
 
 def _get_device_index(valid_input_devices, in_device):
@@ -64,6 +159,7 @@ def _get_device_index(valid_input_devices, in_device):
 
 
 def _pa_get_device_index(in_device, pa=None):
+    import pyaudio
     pa = pa or pyaudio.PyAudio()
 
     valid_input_devices = {}
@@ -76,37 +172,61 @@ def _pa_get_device_index(in_device, pa=None):
     return _get_device_index(valid_input_devices, in_device)
 
 
-def _pa_device_input_process(wd, device, mic_rate, frames_per_buffer, queue, stop_event):
+def _pa_device_input_process(wd, device, mic_rate, channels, frames_per_buffer, ring_name, ring_slots, ready, overflows, underruns, stop_event):
+    import pyaudio
+    ring = SharedBlockRing(ring_slots, frames_per_buffer, channels=channels, name=ring_name)
+
+    def _callback(in_data, frame_count, time_info, status):
+        now = time.time()
+        # Stamp the block with the time its last sample was captured, if the host
+        # API reports when the first one was
+        if time_info.get('input_buffer_adc_time'):
+            now -= max(0.0, time_info['current_time'] - time_info['input_buffer_adc_time'] - frame_count / float(mic_rate))
+        ring.write(in_data, now)
+        if status & pyaudio.paInputOverflow:
+            overflows.value += 1
+        if status & pyaudio.paInputUnderflow:
+            underruns.value += 1
+        wd.value = now
+        ready.set()
+        return None, pyaudio.paContinue
+
     pa = pyaudio.PyAudio()
     device_num = _pa_get_device_index(device, pa=pa)
     stream = pa.open(format=pyaudio.paInt16,
-                    channels=1,
+                    channels=channels,
                     rate=mic_rate,
                     input=True,
                     frames_per_buffer=frames_per_buffer,
-                    input_device_index=device_num
+                    input_device_index=device_num,
+                    stream_callback=_callback
                     )
-    overflows = 0
-    prev_ovf_time = time.time()
 
     try:
-        while not stop_event.is_set():
-            wd.value = time.time()
-            try:
-                queue.put(stream.read(frames_per_buffer, exception_on_overflow=False))
-                stream.read(stream.get_read_available(), exception_on_overflow=False)
-            except IOError:
-                overflows += 1
-                if time.time() > prev_ovf_time + 1:
-                    prev_ovf_time = time.time()
-                    print('Audio buffer has overflowed {} times'.format(overflows))
+        stream.start_stream()
+        while not stop_event.is_set() and stream.is_active():
+            stop_event.wait(0.1)
     finally:
         stream.stop_stream()
         stream.close()
         pa.terminate()
+        ring.close()
 
 
 class PyAudioDeviceInput(Input):
+    """\
+    Captures from a PyAudio device in a separate process
+
+    PortAudio calls back into the capture process with every block, which is written
+    to a SharedBlockRing.  The main loop copies blocks straight out of shared memory
+    into the frame, and knows from the sequence numbers how many it missed.
+    """
+
+    PRODUCES = ('raw_channels', 'raw_audio', 'capture_time')
+
+    # How many periods the capture ring holds before the oldest audio is overwritten
+    RING_PERIODS = 16
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Validate that the configured input device is ok
@@ -115,7 +235,12 @@ class PyAudioDeviceInput(Input):
         self.process = None
         self.watchdog = multiprocessing.Value('d', 0.0)
         self.stop_event = multiprocessing.Event()
-        self.queue = multiprocessing.Queue(maxsize=1)
+        # Set by the capture process after every block, so wait() can block on it
+        self.ready = multiprocessing.Event()
+        self.ring = SharedBlockRing(self.RING_PERIODS, self.frames_per_buffer, channels=self.channels)
+        # Counted by the capture process
+        self.overflows = multiprocessing.Value('q', 0, lock=False)
+        self.underruns = multiprocessing.Value('q', 0, lock=False)
 
     def start_process(self):
         if self.process:
@@ -129,7 +254,7 @@ class PyAudioDeviceInput(Input):
                 logger.error("Process is not alive")
 
         self.watchdog.value = time.time() + 0.5
-        self.process = multiprocessing.Process(target=_pa_device_input_process, args=(self.watchdog, self.config['INPUT_DEVICE'], self.config['MIC_RATE'], self.frames_per_buffer, self.queue, self.stop_event))
+        self.process = multiprocessing.Process(target=_pa_device_input_process, args=(self.watchdog, self.config['INPUT_DEVICE'], self.config['MIC_RATE'], self.channels, self.frames_per_buffer, self.ring.name, self.ring.slots, self.ready, self.overflows, self.underruns, self.stop_event))
         self.process.start()
 
     def start(self, data):
@@ -139,53 +264,436 @@ class PyAudioDeviceInput(Input):
         self.stop_event.set()
         if self.process:
             self.process.join()
+        self.ring.close()
+        self.ring.unlink()
+
+    def restart(self, data):
+        # A block the killed process was writing is detected as missed by the ring
+        if self.process and self.process.is_alive():
+            os.kill(self.process.pid, signal.SIGKILL)
+            self.process.join()
+        self.process = None
+        self.ring.skip()
+        self.start_process()
+
+    def wait(self, timeout):
+        if len(self.ring):
+            return True
+        # Clear before checking again, so a block written in between isn't missed
+        self.ready.clear()
+        if not len(self.ring):
+            self.ready.wait(timeout)
+        return len(self.ring) > 0
 
     def run(self, data):
         self.start_process()
-        try:
-            raw_data = self.queue.get(block=False)
-            with self.fps:
-                raw_data = np.fromstring(raw_data, dtype=np.int16)
-                raw_data = raw_data.astype(np.float32)
-                data['raw_audio'] = raw_data
-        except Empty:
+        if not len(self.ring):
             raise NoData()
+        if self.policy == 'latest' and len(self.ring) > 1:
+            self.count('dropped', len(self.ring) - 1)
+            self.ring.skip(keep=1)
+        with self.fps:
+            if not self.read_batch(data, len(self.ring), self.ring.read_into):
+                # Every pending block was overwritten while it was being read
+                raise NoData()
+        self.counters.update(overflows=self.overflows.value, underruns=self.underruns.value, missed=self.ring.missed)
+        self.report_counters()
 
 
 def _alsa_get_device(in_device):
+    import alsaaudio
     devices = dict(enumerate(alsaaudio.pcms(alsaaudio.PCM_CAPTURE)))
     return devices[_get_device_index(devices, in_device)]
 
 
 class AlsaDeviceInput(Input):
+    """\
+    Captures from an ALSA PCM device
+
+    The device is opened non-blocking.  With INPUT_POLL (the default) the frame clock
+    waits on the device's poll descriptors, so the main loop wakes up as soon as a
+    period has been captured instead of polling the device on a timer.
+    """
+
+    PRODUCES = ('raw_channels', 'raw_audio', 'capture_time')
+
+    # How many periods the capture ring holds before the oldest audio is overwritten
+    RING_PERIODS = 16
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.buffer = b''
+        self.ring = SampleRing(self.frames_per_buffer * self.RING_PERIODS, channels=self.channels)
+        # (ring write position, time) of each read, to stamp periods with their capture time
+        self.arrivals = deque()
+        self.device = None
+        self.poller = None
+        self.open_device()
+
+    def open_device(self):
+        import alsaaudio
         self.device = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, alsaaudio.PCM_NONBLOCK, device=_alsa_get_device(self.config['INPUT_DEVICE']))
-        # Set attributes: Mono, 44100 Hz, 16 bit little endian samples
-        self.device.setchannels(1)
+        # Set attributes: INPUT_CHANNELS, 44100 Hz, 16 bit little endian samples
+        self.device.setchannels(self.channels)
         self.device.setrate(self.config['MIC_RATE'])
         self.device.setformat(alsaaudio.PCM_FORMAT_S16_LE)
         self.device.setperiodsize(self.frames_per_buffer)
 
+        self.poller = None
+        if self.config.get('INPUT_POLL', True):
+            if hasattr(self.device, 'polldescriptors'):
+                self.poller = select.poll()
+                for fd, events in self.device.polldescriptors():
+                    self.poller.register(fd, events)
+            else:
+                logger.warning("This version of PyAlsaAudio can't poll the device, falling back to the frame timer")
+
     def start(self, data):
         pass
 
     def stop(self):
         pass
 
+    def restart(self, data):
+        self.device.close()
+        self.ring.clear()
+        self.arrivals.clear()
+        self.open_device()
+
+    def _read_available(self):
+        # Drain every period the driver has, a read returns at most one
+        for _ in range(self.RING_PERIODS):
+            num_frames, frame_data = self.device.read()
+            if num_frames > 0:
+                self.ring.write(frame_data)
+                self.arrivals.append((self.ring.write_pos, time.time()))
+            elif num_frames < 0:
+                # -EPIPE, the driver's buffer overran
+                self.count('overflows')
+            else:
+                break
+
+    def wait(self, timeout):
+        self._read_available()
+        if len(self.ring) >= self.frames_per_buffer:
+            return True
+        if self.poller is None:
+            # Let the clock sleep until the next period is due
+            return False
+
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self.poller.poll(remaining * 1000):
+                return False
+            self._read_available()
+            if len(self.ring) >= self.frames_per_buffer:
+                return True
+
+    def _read_period(self, out):
+        # A period was captured when its last sample was read
+        end = self.ring.read_pos + self.frames_per_buffer
+        while self.arrivals[0][0] < end:
+            self.arrivals.popleft()
+        self.ring.read_into(out)
+        return self.arrivals[0][1]
+
     def run(self, data):
-        num_frames, frame_data = self.device.read()
-        if num_frames:
-            self.buffer += frame_data
+        self._read_available()
 
-        offset = self.frames_per_buffer * 2
-        if len(self.buffer) < offset:
+        if len(self.ring) < self.frames_per_buffer:
             raise NoData()
 
+        if self.policy == 'latest' and len(self.ring) >= 2 * self.frames_per_buffer:
+            # Keep the newest complete period
+            skipped = len(self.ring) - self.frames_per_buffer
+            self.count('dropped', skipped // self.frames_per_buffer)
+            self.ring.skip(skipped)
+
         with self.fps:
-            raw_data = self.buffer[:offset]
-            self.buffer = self.buffer[offset:]
-            raw_data = np.frombuffer(raw_data, dtype=np.int16)
-            raw_data = raw_data.astype(np.float32)
-            data['raw_audio'] = raw_data
+            self.read_batch(data, len(self.ring) // self.frames_per_buffer, self._read_period)
+        # The ring counts overwritten samples, report whole periods
+        self.counters['missed'] = -(-self.ring.overruns // self.frames_per_buffer)
+        self.report_counters()
+
+
+
+class FileDeviceInput(Input):
+    """\
+    Streams 16 bit PCM from a WAV file or a pipe
+
+    INPUT_DEVICE is a file name, or - for stdin.  WAV data (including a pipe from
+    arecord) is read through the wave module, anything else is taken as raw S16_LE
+    with INPUT_CHANNELS interleaved channels at MIC_RATE (eg. ffmpeg -f s16le -ac 1
+    -ar 44100 -).  A WAV file with a different number of channels is downmixed for
+    mono input, and a mono file is copied to every channel.
+
+    With INPUT_REALTIME (the default) blocks are handed over at the rate they would
+    have been captured, otherwise as fast as the pipeline takes them.  INPUT_LOOP
+    restarts a file when it ends.
+    """
+
+    PRODUCES = ('raw_channels', 'raw_audio', 'capture_time')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filename = self.config.get('INPUT_DEVICE') or '-'
+        self.realtime = self.config.get('INPUT_REALTIME', True)
+        self.loop = self.config.get('INPUT_LOOP', False) and self.filename != '-'
+        self.queue = Queue(maxsize=2)
+        self.pending = None
+        self.stop_event = Event()
+        self.source = None
+        self.thread = None
+
+    def _open(self):
+        stream = sys.stdin.buffer if self.filename == '-' else open(self.filename, 'rb')
+        if stream.peek(4)[:4] != b'RIFF':
+            return stream, lambda n: stream.read(n * 2 * self.channels), self.channels
+
+        wav = wave.open(stream, 'rb')
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{self.filename}: only 16 bit audio is supported")
+        if wav.getframerate() != self.config['MIC_RATE']:
+            raise ValueError(f"{self.filename}: sample rate is {wav.getframerate()}, MIC_RATE is {self.config['MIC_RATE']}")
+        if wav.getnchannels() not in (1, self.channels) and self.channels != 1:
+            raise ValueError(f"{self.filename}: has {wav.getnchannels()} channels, INPUT_CHANNELS is {self.channels}")
+        return stream, wav.readframes, wav.getnchannels()
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Full:
+                if self.realtime:
+                    # Live audio doesn't wait for a slow consumer either
+                    try:
+                        self.queue.get(block=False)
+                        self.count('dropped')
+                    except Empty:
+                        pass
+
+    def _read(self):
+        period = self.frames_per_buffer / float(self.config['MIC_RATE'])
+        next_due = time.time()
+        source = self.source
+        while not self.stop_event.is_set():
+            stream, read, channels = source
+            try:
+                while not self.stop_event.is_set():
+                    frame_data = read(self.frames_per_buffer)
+                    if len(frame_data) < self.frames_per_buffer * channels * 2:
+                        break
+                    samples = np.frombuffer(frame_data, dtype=np.int16).reshape(-1, channels)
+                    if channels != self.channels and self.channels == 1:
+                        samples = samples.mean(axis=1, keepdims=True)
+
+                    if self.realtime:
+                        next_due += period
+                        if next_due < time.time() - period:
+                            # The pipe stalled, don't try to catch up
+                            next_due = time.time()
+                        self.stop_event.wait(max(0.0, next_due - time.time()))
+                    self._put((time.time(), samples))
+            finally:
+                if stream is not sys.stdin.buffer:
+                    stream.close()
+
+            if not self.loop:
+                break
+            source = self._open()
+
+        logger.info("End of audio input %s", self.filename)
+
+    def start(self, data):
+        # Open here so a bad file fails at startup rather than in the reader thread
+        self.source = self._open()
+        self.stop_event = Event()
+        self.thread = Thread(target=self._read, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=1)
+
+    def restart(self, data):
+        self.stop()
+        # Blocks read before the restart are stale by now
+        self.queue = Queue(maxsize=2)
+        self.pending = None
+        self.start(data)
+
+    def wait(self, timeout):
+        if self.pending is None:
+            try:
+                self.pending = self.queue.get(timeout=timeout)
+            except Empty:
+                return False
+        return True
+
+    def _read_block(self, out):
+        raw_data, self.pending = self.pending, None
+        if raw_data is None:
+            try:
+                raw_data = self.queue.get(block=False)
+            except Empty:
+                return None
+        capture_time, samples = raw_data
+        # A mono file is broadcast to every channel
+        np.copyto(out, samples)
+        return capture_time
+
+    def run(self, data):
+        with self.fps:
+            if not self.read_batch(data, (self.pending is not None) + self.queue.qsize(), self._read_block):
+                raise NoData()
+        self.report_counters()
+
+
+class NetworkDeviceInput(Input):
+    """\
+    Receives PCM from another host over UDP or TCP
+
+    INPUT_DEVICE is the address to listen on, udp://host:port or tcp://host:port (the
+    default is udp://0.0.0.0:37738); send_audio.py is a matching sender.  Every UDP
+    packet, or TCP message, is a header of two network order unsigned 32 bit integers
+    - the sequence number and the payload size in bytes - followed by S16_LE frames
+    of INPUT_CHANNELS interleaved channels at MIC_RATE.  Every packet has to carry the
+    same number of frames.
+
+    Packets are reordered in a JitterBuffer with an adaptive delay, and played out one
+    frame per period of the frame clock, so the pipeline sees audio at a steady
+    MIC_RATE/FPS cadence however it arrives.  With INPUT_POLICY latest the buffer
+    aims for the lowest delay and leaves less margin for jitter.  Late and lost
+    packets are counted along with the usual input counters.
+    """
+
+    PRODUCES = ('raw_channels', 'raw_audio', 'capture_time')
+    COUNTERS = Input.COUNTERS + ('late', 'lost')
+
+    # Sequence number and payload size
+    HEADER = struct.Struct('!II')
+    MAX_PACKET = 65536
+    DEFAULT_PORT = 37738
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        url = urlparse(self.config.get('INPUT_DEVICE') or f'udp://0.0.0.0:{self.DEFAULT_PORT}')
+        if url.scheme not in ('udp', 'tcp'):
+            raise ValueError(f"Invalid network input {self.config.get('INPUT_DEVICE')}, use udp://host:port or tcp://host:port")
+        self.protocol = url.scheme
+        self.address = (url.hostname or '0.0.0.0', url.port or self.DEFAULT_PORT)
+        if self.policy == 'latest':
+            self.jitter = JitterBuffer(self.config['MIC_RATE'], self.frames_per_buffer, self.channels, margin=1.0)
+        else:
+            self.jitter = JitterBuffer(self.config['MIC_RATE'], self.frames_per_buffer, self.channels, min_delay=2 * self.frames_per_buffer)
+        self.sock = None
+        self.thread = None
+        self.stop_event = Event()
+
+    def start(self, data):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if self.protocol == 'udp' else socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self.address)
+        if self.protocol == 'tcp':
+            self.sock.listen(1)
+        # Lets the receiver notice the stop event
+        self.sock.settimeout(0.2)
+        logger.info("Network audio input listening on %s://%s:%d", self.protocol, *self.sock.getsockname())
+
+        self.stop_event = Event()
+        self.thread = Thread(target=getattr(self, '_receive_' + self.protocol), name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=1)
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def restart(self, data):
+        self.stop()
+        self.jitter.reset()
+        self.start(data)
+
+    def _packet(self, packet):
+        if len(packet) < self.HEADER.size:
+            logger.debug("Short packet on %s", self.name)
+            return
+        seq, size = self.HEADER.unpack_from(packet)
+        payload = packet[self.HEADER.size:]
+        if size != len(payload) or size % (2 * self.channels):
+            logger.debug("Bad packet %d on %s", seq, self.name)
+            return
+        try:
+            self.jitter.put(seq, payload, time.time())
+        except ValueError as e:
+            logger.debug("Bad packet on %s: %s", self.name, e)
+
+    def _receive_udp(self):
+        # Reused for every packet
+        buf = bytearray(self.MAX_PACKET)
+        view = memoryview(buf)
+        while not self.stop_event.is_set():
+            try:
+                n = self.sock.recv_into(buf)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.stop_event.is_set():
+                    logger.warning("Network audio input %s failed", self.name, exc_info=True)
+                return
+            self._packet(view[:n])
+
+    def _recv_exact(self, conn, view):
+        got = 0
+        while got < len(view):
+            try:
+                n = conn.recv_into(view[got:])
+            except socket.timeout:
+                if self.stop_event.is_set():
+                    return False
+                continue
+            if not n:
+                return False
+            got += n
+        return True
+
+    def _receive_tcp(self):
+        buf = bytearray(self.MAX_PACKET)
+        view = memoryview(buf)
+        while not self.stop_event.is_set():
+            try:
+                conn, addr = self.sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.stop_event.is_set():
+                    logger.warning("Network audio input %s failed", self.name, exc_info=True)
+                return
+
+            logger.info("Network audio input %s connected from %s", self.name, addr)
+            conn.settimeout(0.2)
+            with conn:
+                while self._recv_exact(conn, view[:self.HEADER.size]):
+                    size = self.HEADER.unpack_from(buf)[1]
+                    if self.HEADER.size + size > self.MAX_PACKET:
+                        logger.warning("Message of %d bytes on %s is too large, dropping the connection", size, self.name)
+                        break
+                    if not self._recv_exact(conn, view[self.HEADER.size:self.HEADER.size + size]):
+                        break
+                    self._packet(view[:self.HEADER.size + size])
+            logger.info("Network audio input %s disconnected from %s", self.name, addr)
+
+    def run(self, data):
+        # Frames buffered beyond the target delay are the ones the pipeline fell behind on
+        pending = 1 + max(0, self.jitter.depth() - self.jitter.target_delay) // self.frames_per_buffer
+        with self.fps:
+            read = self.read_batch(data, pending, self.jitter.read_into)
+        self.counters.update(self.jitter.counters)
+        self.report_counters(jitter_ms=self.jitter.jitter * 1000, delay_ms=self.jitter.target_delay * 1000.0 / self.config['MIC_RATE'])
+        if not read:
+            raise NoData()
@@ -0,0 +1,81 @@
+import numpy as np
+
+
+NOTE_NAMES = ('C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B')
+
+# Krumhansl-Kessler key profiles, from the tonic
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+# Triads, from the root
+MAJOR_TRIAD = np.array([1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0], dtype=np.float64)
+MINOR_TRIAD = np.array([1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0], dtype=np.float64)
+
+# Pitch classes on the circle of fifths, as unit vectors
+FIFTHS = np.exp(2j * np.pi * (np.arange(12) * 7 % 12) / 12.0)
+
+
+def chroma_map(n_fft, rate, min_freq=100, max_freq=5000):
+    """\
+    Maps FFT bins to the 12 pitch classes, returns (first bin, bins x 12 weights)
+
+    Every bin between min_freq and max_freq is spread over the pitch classes around
+    its center with a Gaussian as wide as the bin is in semitones (at least half a
+    semitone), so a low bin that spans several semitones is shared between them
+    rather than given to whichever one it happens to be centered on.
+    """
+    bin_hz = rate / float(n_fft)
+    first = max(1, int(np.ceil(min_freq / bin_hz)))
+    last = min(n_fft // 2, int(max_freq / bin_hz))
+    bins = np.arange(first, last + 1)
+    # 0 is C
+    pitch_class = (12 * np.log2(bins * bin_hz / 440.0) + 9) % 12
+    width = np.maximum(6 * np.log2((bins + 0.5) / (bins - 0.5)), 0.5)
+    distance = (np.arange(12)[None, :] - pitch_class[:, None] + 6) % 12 - 6
+    weights = np.exp(-0.5 * (distance / width[:, None])**2)
+    return first, weights / weights.sum(axis=1, keepdims=True)
+
+
+def _rotations(profiles):
+    # Every profile transposed to all 12 roots, row root + 12 * profile
+    return np.array([np.roll(profile, root) for profile in profiles for root in range(12)])
+
+
+def key_templates():
+    """Standardized major and minor key profiles for every tonic, see harmony_name()"""
+    templates = _rotations((MAJOR_PROFILE, MINOR_PROFILE))
+    templates -= templates.mean(axis=1, keepdims=True)
+    return templates / templates.std(axis=1, keepdims=True)
+
+
+def chord_templates():
+    """Unit length major and minor triads for every root, see harmony_name()"""
+    templates = _rotations((MAJOR_TRIAD, MINOR_TRIAD))
+    return templates / np.linalg.norm(templates, axis=1, keepdims=True)
+
+
+def harmony_name(index, chord=False):
+    """Name of row index of the templates, eg. A minor for a key or Am for a chord"""
+    root, minor = NOTE_NAMES[index % 12], index >= 12
+    if chord:
+        return root + ('m' if minor else '')
+    return root + (' minor' if minor else ' major')
+
+
+def chroma_hue(chroma):
+    """\
+    Hue (0-1) of a chroma vector on the circle of fifths, and how strongly it points there (0-1)
+
+    Pitch classes a fifth apart are neighbours on the circle, so related harmonies
+    get related colors.  A single pitch class has strength 1, noise close to 0.
+    """
+    total = chroma.sum()
+    if total <= 0:
+        return 0.0, 0.0
+    direction = np.dot(chroma, FIFTHS)
+    return float(np.angle(direction) / (2 * np.pi) % 1.0), float(abs(direction) / total)
+
+
+def pitch_class_hue(note):
+    """Hue (0-1) of a MIDI note's pitch class on the circle of fifths"""
+    return (int(round(note)) % 12 * 7 % 12) / 12.0
@@ -0,0 +1,98 @@
+import time
+
+from app.lib.network import send_monitor
+
+
+class FrameClock(object):
+    """\
+    Paces the main loop to one pass per audio period
+
+    Each pass is due one period after the previous one started.  wait() blocks until
+    the pass is due - if a waiter is given (usually Input.wait) it is asked to block
+    on the capture device instead, so the pass starts as soon as audio is available
+    rather than when the timer says it should be.
+
+    A pass that starts more than one period after it was due is counted as late, and
+    a pass that takes longer than one period to run is counted as an overrun.  Passes
+    that end with no audio (see mark_empty) are counted separately.
+    """
+
+    # When a pass produced nothing, try again after this fraction of a period
+    RETRY_FRACTION = 0.25
+
+    def __init__(self, name, fps, waiter=None, interval=5):
+        self.name = name
+        self.period = 1.0 / float(fps)
+        self.waiter = waiter
+        self.interval = interval
+
+        self.due = None
+        self.started = None
+        self.empty = False
+        self.last_report = time.time()
+
+        self.totals = {'frames': 0, 'late': 0, 'overruns': 0, 'empty': 0}
+        self.window = dict(self.totals, busy=0.0)
+
+    def wait(self):
+        now = time.time()
+        if self.due is None:
+            self.due = now
+
+        ready = False
+        if self.waiter:
+            # Give the input until one period past the due time, so a stalled capture
+            # device can't stall the network tasks or signal handling
+            ready = self.waiter(max(0.0, self.due + self.period - now))
+
+        if not ready:
+            now = time.time()
+            if self.due > now:
+                time.sleep(self.due - now)
+
+    def mark_empty(self):
+        self.empty = True
+
+    def __enter__(self):
+        self.started = time.time()
+        self.empty = False
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        now = time.time()
+        if self.empty:
+            self._count('empty')
+            self.due = now + (self.period * self.RETRY_FRACTION)
+        else:
+            self._count('frames')
+            self.window['busy'] += now - self.started
+            if self.started - self.due > self.period:
+                self._count('late')
+            if now - self.started > self.period:
+                self._count('overruns')
+
+            # From the start of the pass if the waiter let it start early (a file read
+            # faster than real time), so due can't run ahead of the clock
+            self.due = min(self.due, self.started) + self.period
+            if self.due < now:
+                # Fell behind by more than a period, don't try to catch up on the
+                # timer - the input will hand over whatever is buffered
+                self.due = now
+
+        if now - self.last_report >= self.interval:
+            self.report(now)
+
+    def _count(self, key):
+        self.totals[key] += 1
+        self.window[key] += 1
+
+    def report(self, now=None):
+        now = now or time.time()
+        elapsed = now - self.last_report
+        frames = self.window['frames']
+        fps = frames / elapsed if elapsed else 0
+        avg_busy = (self.window['busy'] / frames) if frames else 0
+        print(f"{self.name} FPS: {fps}, {avg_busy * 1000} ms per, {self.window['late']} late, {self.window['overruns']} overruns, {self.window['empty']} empty")
+        send_monitor(None, 'CLOCK', opname=self.name, fps=fps, busy=avg_busy, budget=self.period, **{k + '_total': v for k, v in self.totals.items()})
+        self.window = dict({k: 0 for k in self.totals}, busy=0.0)
+        self.last_report = now
@@ -8,6 +8,11 @@ BASE_CONFIG = {
     # Configured outputs, see below"""
     'OUTPUTS': [],
 
+    # Processors run after the input, in order, by name (see app.registry) or as
+    # module.Class.  Leave out what no mapping uses, eg. chroma and pitch for LED strips;
+    # a processor's inputs have to come from one listed before it
+    'PROCESSORS': ['spectrum', 'smoothing', 'onset', 'beat', 'pitch', 'chroma', 'loudness', 'idle'],
+
     # Whether or not to display a PyQtGraph GUI plot of visualization"""
     'USE_GUI': True,
 
@@ -62,9 +67,62 @@ BASE_CONFIG = {
     # No music visualization displayed if recorded audio volume below threshold"""
     # 'MIN_VOLUME_THRESHOLD': 1e-7,
     'MIN_VOLUME_THRESHOLD': 0.05,
+
+    # How the mel bins are normalized: gain (one gain for every bin, following the
+    # loudest) or quantile (every bin from its own running MEL_QUANTILES [typical,
+    # loud] level to 0-1, so mapping thresholds mean the same across bands and tracks)
+    'MEL_NORMALIZATION': 'gain',
+    'MEL_QUANTILES': [0.5, 0.95],
+
+    # Short-term loudness (LUFS) below which the audio is idle, eg. -40.  Unset, idle is
+    # decided from the normalized mel bins and IDLE_THRESHOLD
+    'IDLE_LOUDNESS': None,
+
+    # Frequency bands (name: [low Hz, high Hz]) the onset processor detects onsets
+    # in, mappings can trigger on one with {trigger: "onset", band: "bass"}.  Unset,
+    # bass is MIN_FREQUENCY-150, mid 150-2500 and high 2500-MAX_FREQUENCY (the edges
+    # kept inside that range).  A band too narrow for any mel bin uses the closest one
+    'ONSET_BANDS': None,
+    # How far above the median of its last half second a band's flux has to rise to
+    # be an onset, in multiples of its mean; lower is more sensitive, but fires on noise
+    'ONSET_THRESHOLD': 4.0,
+
+    # FFT implementation used by the smoothing processor: numpy, or scipy (which can
+    # split the transforms of a stereo or batched frame over FFT_WORKERS threads)
+    'FFT_BACKEND': 'numpy',
+    'FFT_WORKERS': 1,
+
+    # Number of worker threads used to run independent processors (such as the
+    # smoothing, beat and pitch processors) concurrently.  0 (the default) runs every
+    # task one after another on the main thread.  The processors are short and mostly
+    # hold the GIL, so on most hosts this is slower (bench.py: about 320 FPS with 4
+    # workers against 370 without), measure before turning it on.
+    'PROCESSOR_WORKERS': 0,
 }
 
 
+# Settings that size buffers or open sockets and devices at startup, a reload keeps the
+# running value (as do all INPUT_* settings)
+RESTART_KEYS = ('MIC_RATE', 'FPS', 'N_FFT_BINS', 'N_ROLLING_HISTORY', 'USE_GUI', 'NETWORK_HOST', 'NETWORK_PORT', 'PROCESSORS')
+
+# Settings changed while running (by network commands or command line options), a
+# reload keeps them
+RUNTIME_KEYS = ('SUSPENDED', 'ENABLE_LINKS', 'RECORD')
+
+
+def diff_config(old, new):
+    """\
+    Compare a reloaded configuration with the running one
+
+    Returns the set of top level keys (other than OUTPUTS) that changed, and the subset of
+    those that only take effect after a restart.  Outputs are compared by name by the
+    caller.
+    """
+    changed = set(k for k in set(old) | set(new) if k not in ('OUTPUTS',) + RUNTIME_KEYS and old.get(k) != new.get(k))
+    restart = set(k for k in changed if k in RESTART_KEYS or k.startswith('INPUT_'))
+    return changed, restart
+
+
 def parse_config(filename=None):
     """Parse a configuration from the given filename, or find an appropriate config file
 
@@ -93,7 +151,7 @@ def parse_config(filename=None):
             if filename.endswith('json'):
                 config.update(json.load(fp))
             else:
-                config.update(yaml.load(fp))
+                config.update(yaml.safe_load(fp))
     config['OUTPUTS'] = list(map(_parse_output, config['OUTPUTS']))
 
     # Figure out the max FPS
@@ -101,6 +159,10 @@ def parse_config(filename=None):
     if config['FPS'] > max_fps:
         raise ValueError(f"FPS must be <= {max_fps}, is {config['FPS']}")
 
+    quantiles = config['MEL_QUANTILES']
+    if len(quantiles) != 2 or not 0 < quantiles[0] < quantiles[1] < 1:
+        raise ValueError(f"MEL_QUANTILES must be [typical, loud] with 0 < typical < loud < 1, is {quantiles}")
+
     return config
 
 
@@ -23,6 +23,199 @@ class ExpFilter:
         self.value = alpha * value + (1.0 - alpha) * self.value
         return self.value
 
+    def update_many(self, values):
+        """\
+        Advance the filter by one step for every row of values, returns the value after each step
+
+        Whether a step rises or decays depends on the previous one, so the steps are
+        taken in turn, each over the whole row at once.
+        """
+        return np.array([self.update(value) for value in values])
+
+
+class SparseMelBank(object):
+    """\
+    Mel filterbank stored sparsely, applied without allocating per frame
+
+    Every triangular band of a mel matrix from create_mel_bank covers a single run of
+    FFT bins, so only those runs are kept: the weights of all bands back to back, the
+    FFT bin each weight applies to, and the offset where each band starts.  apply()
+    gathers the bins, weights them and sums each band with one reduceat, all into
+    buffers that only grow to the largest number of spectra seen.
+
+    The gather has a fixed cost that a BLAS product doesn't, so a small bank (up to
+    DENSE_MAX bands x FFT bins, which includes the default N_FFT_BINS) is applied as
+    a dense product over just the FFT bins the bands cover instead.
+    """
+
+    # Bands x covered FFT bins up to which the dense product is the faster one
+    DENSE_MAX = 100000
+
+    def __init__(self, melmat):
+        self.bands, self.fft_bins = melmat.shape
+        covered = np.flatnonzero(melmat.any(axis=0))
+        self.span = slice(covered[0], covered[-1] + 1) if len(covered) else slice(0, 0)
+        self.dense = None
+        if self.bands * (self.span.stop - self.span.start) <= self.DENSE_MAX:
+            self.dense = np.ascontiguousarray(melmat[:, self.span].T)
+        starts = []
+        indices = []
+        for band in melmat:
+            nonzero = np.flatnonzero(band)
+            starts.append(len(indices))
+            if len(nonzero):
+                indices.extend(range(nonzero[0], nonzero[-1] + 1))
+        self.indices = np.array(indices, dtype=np.intp)
+        self.weights = melmat[np.repeat(np.arange(self.bands), np.diff(starts + [len(indices)])), self.indices]
+        # reduceat can't produce an empty sum, those bands are zeroed afterwards, and
+        # empty bands at the end are left out of it altogether
+        self.empty = np.flatnonzero(np.diff(starts + [len(indices)]) == 0)
+        self.offsets = np.array([start for start in starts if start < len(indices)], dtype=np.intp)
+        self._allocate(1)
+
+    def _allocate(self, rows):
+        self.gathered = np.zeros((rows, len(self.indices)), dtype=np.float32)
+        self.weighted = np.zeros((rows, len(self.indices)))
+        self.out = np.zeros((rows, self.bands))
+
+    def apply(self, spectrum):
+        """Mel spectrum of the FFT magnitudes (... x fft_bins), in a buffer reused by the next call"""
+        rows = spectrum.reshape(-1, self.fft_bins)
+        n = len(rows)
+        if n > len(self.out):
+            self._allocate(n)
+        if self.dense is not None:
+            np.dot(rows[:, self.span], self.dense, out=self.out[:n])
+        elif len(self.indices):
+            np.take(rows, self.indices, axis=1, out=self.gathered[:n])
+            np.multiply(self.gathered[:n], self.weights, out=self.weighted[:n])
+            np.add.reduceat(self.weighted[:n], self.offsets, axis=1, out=self.out[:n, :len(self.offsets)])
+        if self.dense is None and len(self.empty):
+            self.out[:n, self.empty] = 0.0
+        return self.out[:n].reshape(spectrum.shape[:-1] + (self.bands,))
+
+
+class PeakPicker(object):
+    """\
+    Picks onsets from onset detection functions with an adaptive threshold
+
+    update() takes the next value of one or more detection functions (eg. one per
+    band) at once.  A function fires when it rises above the median of its recent
+    history plus threshold times the mean, at most once every min_interval frames,
+    and has to fall below again before it can fire again.
+    """
+
+    def __init__(self, size, bands=1, threshold=0.3, min_interval=3):
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.history = np.zeros((size, bands))
+        self.pos = 0
+        self.above = np.zeros(bands, dtype=bool)
+        self.since = np.full(bands, min_interval)
+
+    def update(self, values):
+        """Returns which functions fired, and by how much they are above the threshold"""
+        limit = np.median(self.history, axis=0) + self.threshold * self.history.mean(axis=0)
+        self.history[self.pos % len(self.history)] = values
+        self.pos += 1
+
+        excess = np.maximum(values - limit, 0.0)
+        above = excess > 0
+        self.since += 1
+        fired = above & ~self.above & (self.since >= self.min_interval)
+        self.since[fired] = 0
+        self.above = above
+        return fired, excess
+
+
+class StreamingQuantiles(object):
+    """\
+    Running estimates of a few quantiles of each of a number of values (eg. bins)
+
+    Constant memory stochastic approximation ("frugal" streaming quantiles) in the
+    log domain: an estimate steps up by rate * p when an observation is above it and
+    down by rate * (1 - p) when it's below, so it settles where a fraction p of the
+    observations are below it, and keeps following them when they change.  Steps are
+    in log units, so how fast that is doesn't depend on the level: a tenfold change
+    takes about log(10) / (rate * p) observations upwards, log(10) / (rate * (1 - p))
+    downwards.  Every value and quantile moves in one vectorized step.
+    """
+
+    # Observations are clipped to this, the log of 0 wouldn't do
+    FLOOR = 1e-12
+
+    def __init__(self, quantiles, rate=0.05):
+        self.quantiles = np.array(quantiles, dtype=np.float64)[None, :]
+        self.rate = rate
+        self.log_value = None
+
+    @property
+    def value(self):
+        """Estimates, values x quantiles"""
+        return None if self.log_value is None else np.exp(self.log_value)
+
+    def update(self, values):
+        """Add one observation of every value, returns the estimates"""
+        log_values = np.log(np.maximum(values, self.FLOOR))[:, None]
+        if self.log_value is None:
+            self.log_value = np.repeat(log_values, self.quantiles.shape[1], axis=1)
+        else:
+            self.log_value += self.rate * (self.quantiles - (log_values < self.log_value))
+        return self.value
+
+
+class RunningMean(object):
+    """\
+    Mean of the last size values, at a constant cost per value
+
+    A running total is kept next to a ring of the values, and recomputed from the
+    ring once per lap so rounding errors can't pile up.
+    """
+
+    def __init__(self, size):
+        self.values = np.zeros(size)
+        self.total = 0.0
+        self.count = 0
+
+    def update(self, values):
+        """Add one or more values, returns the mean of the last size (fewer at the start)"""
+        size = len(self.values)
+        for value in np.atleast_1d(values):
+            slot = self.count % size
+            self.total += value - self.values[slot]
+            self.values[slot] = value
+            self.count += 1
+            if not self.count % size:
+                self.total = self.values.sum()
+        return self.total / min(self.count, size)
+
+
+def k_weighting(rate):
+    """\
+    Second order sections of the ITU-R BS.1770 K-weighting filter at any sample rate
+
+    A +4 dB high shelf around 1.5 kHz for the head, then a high pass at 38 Hz,
+    designed like the standard's 48 kHz coefficients.
+    """
+    gain = 10**(4.0 / 40)
+    w0 = 2 * np.pi * 1500.0 / rate
+    alpha = np.sin(w0) / np.sqrt(2)
+    cos, root = np.cos(w0), 2 * np.sqrt(gain) * alpha
+    shelf_b = [gain * ((gain + 1) + (gain - 1) * cos + root),
+               -2 * gain * ((gain - 1) + (gain + 1) * cos),
+               gain * ((gain + 1) + (gain - 1) * cos - root)]
+    shelf_a = [(gain + 1) - (gain - 1) * cos + root,
+               2 * ((gain - 1) - (gain + 1) * cos),
+               (gain + 1) - (gain - 1) * cos - root]
+
+    w0 = 2 * np.pi * 38.0 / rate
+    alpha = np.sin(w0)
+    high_pass_a = [1 + alpha, -2 * np.cos(w0), 1 - alpha]
+    return np.array([
+        np.concatenate([shelf_b, shelf_a]) / shelf_a[0],
+        np.concatenate([[1.0, -2.0, 1.0], np.array(high_pass_a) / high_pass_a[0]]),
+        ])
+
 
 # def rfft(data, window=None):
 #     window = 1.0 if window is None else window(len(data))
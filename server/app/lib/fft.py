@@ -0,0 +1,98 @@
+import numpy as np
+
+
+BACKENDS = ('numpy', 'scipy')
+
+
+def rfft_backend(name='numpy', workers=None):
+    """\
+    Returns rfft(x, out), a real FFT along the last axis of x written into out
+
+    numpy is always available.  scipy.fft can split a batch of transforms over
+    workers threads, and keeps the plans for the sizes it has seen cached.
+    """
+    if name == 'numpy':
+        if np.lib.NumpyVersion(np.__version__) >= '2.0.0':
+            def _rfft(x, out):
+                return np.fft.rfft(x, axis=-1, out=out)
+        else:
+            def _rfft(x, out):
+                out[...] = np.fft.rfft(x, axis=-1)
+                return out
+        return _rfft
+
+    if name == 'scipy':
+        import scipy.fft
+
+        def _rfft(x, out):
+            # Not overwrite_x, the zero padding has to survive
+            out[...] = scipy.fft.rfft(x, axis=-1, workers=workers)
+            return out
+        return _rfft
+
+    raise ValueError(f"Invalid FFT_BACKEND {name}, must be one of {', '.join(BACKENDS)}")
+
+
+def fft_size(block_size, history):
+    """FFT length for a rolling window of history blocks, zero padded to the next power of two"""
+    return 2**int(np.ceil(np.log2(block_size * history)))
+
+
+class RollingFFT(object):
+    """\
+    Windowed FFT magnitudes of a rolling window of audio blocks
+
+    Every buffer is allocated up front.  Blocks are written to a ring twice, once in
+    each half, so the rolling window is always one contiguous slice of it and is
+    windowed straight into a zero padded FFT input buffer.  The transform runs over
+    a batch of windows at once (one per frame of a batch, see push() and
+    window_into()) and writes into a reused spectrum buffer.
+
+    Samples are int16 scale and are normalized to [-1, 1].  transform() returns the
+    magnitudes of all n_fft / 2 + 1 bins.
+    """
+
+    def __init__(self, block_size, history, channels=1, batch=1, backend='numpy', workers=None):
+        self.block_size = block_size
+        self.history = history
+        self.channels = channels
+        self.size = block_size * history
+        self.n_fft = fft_size(block_size, history)
+        self.bins = self.n_fft // 2 + 1
+        self.window = np.hamming(self.size).astype(np.float32)
+        self.ring = np.zeros((channels, 2 * self.size), dtype=np.float32)
+        # Peak level of every block in the window
+        self.peaks = np.zeros(history)
+        self.blocks = 0
+        self.rfft = rfft_backend(backend, workers)
+        self._allocate(batch)
+
+    def _allocate(self, batch):
+        self.padded = np.zeros((batch, self.channels, self.n_fft), dtype=np.float32)
+        self.spectrum = np.zeros((batch, self.channels, self.bins), dtype=np.complex64)
+
+    def push(self, block):
+        """Append a block (channels x block_size), returns the peak level of the window"""
+        slot = self.blocks % self.history
+        start = slot * self.block_size
+        for offset in (start, start + self.size):
+            np.multiply(block, 1.0 / 2**15, out=self.ring[:, offset:offset + self.block_size])
+        self.peaks[slot] = max(block.max(), -block.min()) / 2.0**15
+        self.blocks += 1
+        return self.peaks.max()
+
+    def window_into(self, i):
+        """Apply the FFT window to the current rolling window, as input i of the next transform()"""
+        if i >= len(self.padded):
+            # Only grows to the largest batch seen
+            padded = self.padded
+            self._allocate(i + 1)
+            self.padded[:len(padded)] = padded
+        start = (self.blocks % self.history) * self.block_size
+        np.multiply(self.ring[:, start:start + self.size], self.window, out=self.padded[i, :, :self.size])
+
+    def transform(self, out):
+        """Transform the first len(out) inputs, writing their magnitudes to out (n x channels x bins)"""
+        n = len(out)
+        self.rfft(self.padded[:n], self.spectrum[:n])
+        return np.abs(self.spectrum[:n], out=out)
@@ -0,0 +1,144 @@
+from threading import Lock
+
+import numpy as np
+
+
+class JitterBuffer(object):
+    """\
+    Reorders sequenced PCM packets and plays them out at a steady rate
+
+    Packets carry a sequence number and a fixed number of frames (set by the first
+    packet), so every packet has a fixed place on the sample timeline.  A receiver
+    thread put()s packets as they arrive, in any order; the main loop read_into()s
+    one block of frames per period from the playout position, which trails the newest
+    packet by a target delay.
+
+    The target delay adapts to the measured jitter (the RFC 3550 interarrival jitter
+    estimate, scaled by margin), between min_delay and half the buffer.  Gaps
+    the playout position reaches are played as silence and counted as lost, packets
+    that arrive after their place was played are counted as late.  If the playout
+    position runs into the newest packet, the block is padded with silence and counted
+    as an underrun; if it falls too far behind (the sender's clock runs fast, or a
+    burst arrived after a stall) it skips ahead and counts the skipped blocks as
+    dropped.
+    """
+
+    def __init__(self, rate, block_size, channels=1, slots=64, min_delay=None, margin=3.0):
+        self.rate = rate
+        self.margin = margin
+        self.block_size = block_size
+        self.channels = channels
+        self.slots = slots
+        self.min_delay = min_delay or block_size
+        self.lock = Lock()
+        self.packet_size = None
+        self.samples = None
+        self.slot_seq = np.full(slots, -1, dtype=np.int64)
+        self.arrivals = np.zeros(slots, dtype=np.float64)
+        self.counters = {'late': 0, 'lost': 0, 'underruns': 0, 'dropped': 0}
+        self.reset()
+
+    def reset(self):
+        """Start over with the next packet, eg. when the sender restarts"""
+        with self.lock:
+            self.newest = None
+            self.play_pos = None
+            self.buffering = True
+            self.prev_transit = None
+            self.jitter = 0.0
+            self.last_lost = None
+            self.slot_seq[:] = -1
+
+    @property
+    def target_delay(self):
+        """Frames to keep buffered ahead of the playout position"""
+        capacity = self.slots * (self.packet_size or self.block_size)
+        delay = self.min_delay + self.margin * self.jitter * self.rate
+        return int(min(max(delay, self.min_delay), capacity // 2))
+
+    def depth(self):
+        """Frames buffered ahead of the playout position"""
+        if self.play_pos is None or self.newest is None:
+            return 0
+        return (self.newest + 1) * self.packet_size - self.play_pos
+
+    def put(self, seq, payload, arrival):
+        """Add a packet of raw interleaved int16 frames"""
+        frames = np.frombuffer(payload, dtype=np.int16).reshape(-1, self.channels)
+        with self.lock:
+            if self.packet_size is None:
+                self.packet_size = len(frames)
+                self.samples = np.zeros((self.slots, self.packet_size, self.channels), dtype=np.int16)
+            if len(frames) != self.packet_size:
+                raise ValueError(f"Packet {seq} has {len(frames)} frames, expected {self.packet_size}")
+
+            if self.newest is not None and abs(seq - self.newest) > self.slots * 4:
+                # The sender restarted, or the connection was down for a long time
+                self.newest = self.play_pos = self.prev_transit = None
+                self.slot_seq[:] = -1
+            if self.play_pos is None:
+                self.play_pos = seq * self.packet_size
+                self.buffering = True
+            if (seq + 1) * self.packet_size <= self.play_pos:
+                self.counters['late'] += 1
+                return
+
+            slot = seq % self.slots
+            self.samples[slot] = frames
+            self.arrivals[slot] = arrival
+            self.slot_seq[slot] = seq
+
+            transit = arrival - seq * self.packet_size / float(self.rate)
+            if self.prev_transit is not None and seq == self.newest + 1:
+                self.jitter += (abs(transit - self.prev_transit) - self.jitter) / 16.0
+            self.prev_transit = transit
+            if self.newest is None or seq > self.newest:
+                self.newest = seq
+
+    def read_into(self, out):
+        """\
+        Copy the next block of frames into out (frames x channels)
+
+        Returns the arrival time of the newest packet in the block, or None while
+        buffering up to the target delay (at the start, and after running dry).
+        """
+        with self.lock:
+            depth = self.depth()
+            if self.buffering:
+                if self.newest is None or depth < self.target_delay:
+                    return None
+                self.buffering = False
+            if depth <= 0:
+                # Nothing left at all, buffer up again
+                self.buffering = True
+                self.counters['underruns'] += 1
+                return None
+            if depth > 2 * self.target_delay + self.block_size:
+                skip = depth - self.target_delay
+                self.counters['dropped'] += skip // self.block_size
+                self.play_pos += skip
+            if depth < self.block_size:
+                self.counters['underruns'] += 1
+
+            arrival = None
+            pos = self.play_pos
+            end = pos + len(out)
+            while pos < end:
+                seq, offset = divmod(pos, self.packet_size)
+                n = min(end - pos, self.packet_size - offset)
+                slot = seq % self.slots
+                dest = out[pos - self.play_pos:pos - self.play_pos + n]
+                if self.slot_seq[slot] == seq:
+                    dest[:] = self.samples[slot, offset:offset + n]
+                    arrival = self.arrivals[slot]
+                else:
+                    dest[:] = 0
+                    if seq <= self.newest and seq != self.last_lost:
+                        self.counters['lost'] += 1
+                        self.last_lost = seq
+                pos += n
+            self.play_pos = end
+            if arrival is None:
+                # Everything in the block was lost
+                arrival = self.arrivals[self.newest % self.slots]
+            return float(arrival)
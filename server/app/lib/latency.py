@@ -0,0 +1,60 @@
+import time
+from threading import Lock
+
+import numpy as np
+
+from app.lib.network import send_monitor
+
+
+class LatencyTracker(object):
+    """\
+    Collects mic-to-light latency samples per stage
+
+    Inputs stamp each frame with the time its audio was captured (capture_time), and
+    every stage records how long after capture it got to that frame: the input itself
+    (capture buffering), each task in the pipeline (DSP) and the moment outputs hand
+    data to their device (output I/O).  Percentiles for each stage are sent to the
+    monitor every interval seconds, and printed if print_reports is set.  Tasks run
+    by a TaskGroup record from its worker threads, so the samples are locked.
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, interval=5, print_reports=False):
+        self.interval = interval
+        self.print_reports = print_reports
+        self.samples = {}
+        self.last_report = time.time()
+        self.lock = Lock()
+
+    def record(self, stage, data):
+        capture_time = data.get('capture_time')
+        if capture_time is None:
+            return
+        now = time.time()
+        with self.lock:
+            self.samples.setdefault(stage, []).append(now - capture_time)
+            if now - self.last_report < self.interval:
+                return
+        self.report(now)
+
+    def report(self, now=None):
+        with self.lock:
+            samples_by_stage, self.samples = self.samples, {}
+            self.last_report = now or time.time()
+        for stage, samples in samples_by_stage.items():
+            if not samples:
+                continue
+            samples = np.array(samples) * 1000
+            stats = dict(zip((f'p{p}' for p in self.PERCENTILES), np.percentile(samples, self.PERCENTILES).tolist()))
+            stats.update(max=float(samples.max()), count=len(samples))
+            send_monitor(None, 'LATENCY', opname=stage, **stats)
+            if self.print_reports:
+                print(f"Latency {stage}: " + ', '.join(f"{k} {v:.1f} ms" for k, v in stats.items() if k != 'count') + f" ({stats['count']} frames)")
+
+
+tracker = LatencyTracker()
+
+
+def record_latency(stage, data):
+    tracker.record(stage, data)
@@ -4,6 +4,7 @@ import logging
 import json
 import re
 
+from app import Task
 from app.effects import Effect
 
 
@@ -43,6 +44,9 @@ class Network(object):
         self.server_sock.listen(5)
 
         self.input_queue = {}
+        self.frame = None
+        # Set by the RELOAD command, the main loop reloads the config between frames
+        self.reload_requested = False
 
         logger.info("Network listening on %s:%d", host, port)
 
@@ -116,6 +120,8 @@ class Network(object):
         self.send_command(sock, 'ERROR', code=errcode, argument=errarg, error=errstr)
 
     def run_input(self, data):
+        # Commands that push DMX immediately write into the current frame
+        self.frame = data
         r, _, _ = select.select([self.server_sock] + self.clients, [], [], 0)
         for s in r:
             if s is self.server_sock:
@@ -276,7 +282,7 @@ class Network(object):
                     'speed': props.get('speed', l.state['speed']),
                     'dim': props.get('dim', l.state['dim']),
                 })
-                l.send_dmx({}, force=True)
+                l.send_dmx(self.frame, force=True)
 
             l.state.update(props)
             out.append({'light': l.name, 'result': True})
@@ -304,15 +310,18 @@ class Network(object):
 
         self.send_command(s, 'OK', *out)
 
+    def _command_reload(self, s, *a, **ka):
+        self.reload_requested = True
+        self.send_command(s, 'OK')
+
     def _command_monitor(self, s, *a, **ka):
         self.monitor_clients.append(s)
         self.send_command(s, 'OK')
 
 
-class NetworkTask(object):
+class NetworkTask(Task):
     def __init__(self, name, config, network, position, *args, **kwargs):
-        self.name = name
-        self.config = config
+        super().__init__(name, config, *args, **kwargs)
         self.network = network
         self.position = position
 
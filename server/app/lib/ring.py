@@ -0,0 +1,162 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+class SampleRing(object):
+    """\
+    Preallocated ring buffer of audio samples
+
+    Raw sample bytes are copied in through a memoryview over the sample array, and
+    the oldest samples are read back as array views (two of them where they wrap
+    around) or copied straight into the reader's own buffer.  Positions count samples
+    written and read since the ring was created, so consuming data never moves the
+    rest of it.  With more than one channel, samples are interleaved frames and sizes
+    and positions count frames.
+
+    If the reader falls more than the ring size behind, the oldest samples are
+    overwritten and counted in overruns.
+    """
+
+    def __init__(self, size, channels=1, dtype=np.int16):
+        self.size = size
+        self.samples = np.zeros((size, channels), dtype=dtype)
+        self.bytes = memoryview(self.samples).cast('B')
+        self.itemsize = self.samples.itemsize * channels
+        self.write_pos = 0
+        self.read_pos = 0
+        self.overruns = 0
+
+    def __len__(self):
+        return self.write_pos - self.read_pos
+
+    def clear(self):
+        self.read_pos = self.write_pos
+
+    def skip(self, n):
+        """Drop the oldest n samples"""
+        self.read_pos += min(n, len(self))
+
+    def write(self, data):
+        """Copy in raw sample bytes, returns the number of samples written"""
+        data = memoryview(data).cast('B')
+        count = n = len(data) // self.itemsize
+        if n > self.size:
+            # Only the newest samples fit
+            data = data[(n - self.size) * self.itemsize:]
+            self.write_pos += n - self.size
+            n = self.size
+
+        start = self.write_pos % self.size
+        first = min(n, self.size - start)
+        self.bytes[start * self.itemsize:(start + first) * self.itemsize] = data[:first * self.itemsize]
+        self.bytes[:(n - first) * self.itemsize] = data[first * self.itemsize:n * self.itemsize]
+        self.write_pos += n
+
+        if len(self) > self.size:
+            self.overruns += len(self) - self.size
+            self.read_pos = self.write_pos - self.size
+        return count
+
+    def views(self, n):
+        """Views of the oldest n samples, the second one is empty unless they wrap around"""
+        start = self.read_pos % self.size
+        first = min(n, self.size - start)
+        return self.samples[start:start + first], self.samples[:n - first]
+
+    def read_into(self, out):
+        """Move the oldest len(out) frames into out (frames x channels), converting to its dtype"""
+        head, tail = self.views(len(out))
+        out[:len(head)] = head
+        out[len(head):] = tail
+        self.read_pos += len(out)
+
+
+class SharedBlockRing(object):
+    """\
+    Ring of fixed size sample blocks in shared memory, for one writer and one reader
+
+    Every block is stamped with a sequence number and a capture time.  The writer
+    invalidates a slot before overwriting it and publishes the block by storing its
+    sequence number afterwards.  The reader copies blocks out in order and checks the
+    sequence number again once it is done, so a block the writer lapped while it was
+    being read is counted in missed instead of being returned torn.
+
+    The creating side owns the memory and has to unlink() it.  The other process
+    attaches with the name, slots, block_size and channels of the original.
+    """
+
+    HEADER = 8
+
+    def __init__(self, slots, block_size, channels=1, dtype=np.int16, name=None):
+        self.slots = slots
+        self.block_size = block_size
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        size = self.HEADER + slots * 16 + slots * block_size * channels * self.dtype.itemsize
+        self.shm = SharedMemory(name=name, create=name is None, size=size)
+        buf = self.shm.buf
+        # Sequence number of the next block to be written
+        self.head = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        self.seqs = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=self.HEADER)
+        self.times = np.ndarray((slots,), dtype=np.float64, buffer=buf, offset=self.HEADER + slots * 8)
+        self.blocks = np.ndarray((slots, block_size, channels), dtype=self.dtype, buffer=buf, offset=self.HEADER + slots * 16)
+        if name is None:
+            self.head[0] = 0
+            self.seqs[:] = -1
+
+        self.read_seq = 0
+        self.missed = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        # The arrays point into the mapping, it can't be closed while they exist
+        self.head = self.seqs = self.times = self.blocks = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+    def __len__(self):
+        """Number of blocks written but not read yet"""
+        return int(self.head[0]) - self.read_seq
+
+    def write(self, data, timestamp):
+        """Copy in one block of raw sample bytes"""
+        seq = int(self.head[0])
+        slot = seq % self.slots
+        self.seqs[slot] = -1
+        np.copyto(self.blocks[slot], np.frombuffer(data, dtype=self.dtype).reshape(self.block_size, self.channels))
+        self.times[slot] = timestamp
+        self.seqs[slot] = seq
+        self.head[0] = seq + 1
+
+    def skip(self, keep=0):
+        """Drop everything not read yet, except for the newest keep blocks"""
+        self.read_seq = max(self.read_seq, int(self.head[0]) - keep)
+
+    def read_into(self, out):
+        """\
+        Copy the oldest unread block into out (frames x channels), converting to its dtype
+
+        Returns the capture time of the block, or None if there is nothing to read.
+        """
+        while True:
+            head = int(self.head[0])
+            if head - self.read_seq > self.slots:
+                self.missed += head - self.slots - self.read_seq
+                self.read_seq = head - self.slots
+            if self.read_seq >= head:
+                return None
+
+            seq = self.read_seq
+            slot = seq % self.slots
+            self.read_seq += 1
+            np.copyto(out, self.blocks[slot])
+            timestamp = float(self.times[slot])
+            if self.seqs[slot] == seq:
+                return timestamp
+            self.missed += 1
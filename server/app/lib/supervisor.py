@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+import signal
+import time
+
+
+class TaskStalled(Exception):
+    def __init__(self, index):
+        super().__init__(f"Task {index} stalled")
+        self.index = index
+
+
+class Heartbeat(object):
+    """\
+    Per-task heartbeat shared between the server and its supervisor
+
+    The server calls beat() with the index of the task it is about to run (or IDLE
+    while it waits for the next frame, STARTING before the first frame).  The
+    supervisor process watches how long the current beat has lasted, and can ask the
+    server to restart the stuck task through request_restart(), which interrupts it
+    with a TaskStalled exception.
+
+    The values live in shared memory allocated before the server is forked.  The
+    server sets armed only while its main loop can catch TaskStalled, so the exception
+    can't land in cleanup code (or in the handler of the previous one) and escape.
+    """
+
+    IDLE = -1
+    STARTING = -2
+
+    def __init__(self):
+        self.current = multiprocessing.Value('i', self.STARTING, lock=False)
+        self.since = multiprocessing.Value('d', time.time(), lock=False)
+        self.restart_index = multiprocessing.Value('i', self.IDLE, lock=False)
+        # Not shared, set in the server process
+        self.armed = False
+
+    def beat(self, index):
+        self.since.value = time.time()
+        self.current.value = index
+
+    def stalled(self):
+        """Returns the index of the current task, and for how long it has been running"""
+        return self.current.value, time.time() - self.since.value
+
+    def request_restart(self, pid, index):
+        self.restart_index.value = index
+        os.kill(pid, signal.SIGUSR1)
+
+    def install_handler(self):
+        """Interrupt the stalled task when the supervisor asks for a restart"""
+        def _handler(signo, frame):
+            # The task may have recovered in the meantime
+            if self.armed and self.restart_index.value == self.current.value:
+                # Once per pass of the main loop
+                self.armed = False
+                raise TaskStalled(self.current.value)
+        signal.signal(signal.SIGUSR1, _handler)
@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class TempoTracker(object):
+    """\
+    Follows the tempo of an onset detection function and predicts the beats
+
+    update() is called once per frame with the next value of the detection function.
+    Every interval seconds the beat period is estimated from the autocorrelation of
+    the last history seconds of the function, weighted towards 120 BPM so the tracker
+    prefers the tactus over half or double time, and the phase from a comb of beats
+    at that period.  In between, beats are predicted a period apart, and update()
+    returns True for the frame a predicted beat falls on, and phase and
+    frames_to_beat tell where the last frame is relative to the beats.
+
+    If the autocorrelation peak is too weak (no steady pulse, or silence) there is
+    no tempo and no beats until the next estimate finds one.
+    """
+
+    # Autocorrelation at the beat period relative to the signal energy
+    MIN_CONFIDENCE = 0.05
+
+    def __init__(self, fps, history=6.0, interval=0.5, min_bpm=60, max_bpm=180):
+        self.fps = fps
+        self.size = int(history * fps)
+        self.interval = max(1, int(interval * fps))
+        self.odf = np.zeros(self.size)
+        self.frame = 0
+        # In frames, None without a tempo
+        self.period = None
+        self.next_beat = None
+        self.last_beat = -np.inf
+        self.confidence = 0.0
+
+        self.min_lag = max(1, int(fps * 60.0 / max_bpm))
+        self.max_lag = min(self.size // 2, int(np.ceil(fps * 60.0 / min_bpm)))
+        lags = np.arange(self.min_lag, self.max_lag + 1)
+        # Log-Gaussian preference, an octave wide, around 120 BPM
+        self.weights = np.exp(-0.5 * np.log2(lags / (fps * 0.5))**2)
+
+    @property
+    def bpm(self):
+        return 60.0 * self.fps / self.period if self.period else None
+
+    @property
+    def frames_to_beat(self):
+        """Frames from the last update() to the next predicted beat, None without a tempo"""
+        return self.next_beat - (self.frame - 1) if self.period else None
+
+    @property
+    def phase(self):
+        """How far the last update() is into the current beat, 0-1, None without a tempo"""
+        if not self.period:
+            return None
+        return min(max(1.0 - self.frames_to_beat / self.period, 0.0), 1.0)
+
+    def update(self, value):
+        self.odf[self.frame % self.size] = value
+        now = self.frame
+        self.frame += 1
+        if self.frame >= self.size // 2 and not self.frame % self.interval:
+            self._estimate(now)
+
+        if self.next_beat is not None and now >= self.next_beat - 0.5:
+            self.last_beat = now
+            self.next_beat += self.period
+            return True
+        return False
+
+    def _estimate(self, now):
+        # Oldest first
+        x = np.roll(self.odf, -self.frame % self.size)[-min(self.frame, self.size):]
+        x = x - x.mean()
+        spectrum = np.fft.rfft(x, 2 * len(x))
+        acf = np.fft.irfft(spectrum.real**2 + spectrum.imag**2)[:self.max_lag + 2]
+        if acf[0] <= 0:
+            self.period = self.next_beat = None
+            return
+
+        lag = self.min_lag + int(np.argmax(acf[self.min_lag:self.max_lag + 1] * self.weights))
+        self.confidence = acf[lag] / acf[0]
+        if self.confidence < self.MIN_CONFIDENCE:
+            self.period = self.next_beat = None
+            return
+        # Parabolic interpolation between lags
+        a, b, c = acf[lag - 1:lag + 2]
+        offset = 0.5 * (a - c) / (a - 2 * b + c) if a - 2 * b + c < 0 else 0.0
+        self.period = lag + offset
+
+        # Frames since the last beat: the phase where beats a period apart line up
+        # with the most onsets
+        beats = np.arange(int(len(x) / self.period))
+        phases = np.arange(int(self.period))
+        positions = np.rint(len(x) - 1 - phases[:, None] - self.period * beats[None, :]).astype(int)
+        comb = np.where(positions >= 0, x[positions], 0.0).sum(axis=1)
+        next_beat = now - int(np.argmax(comb))
+        # A beat that fell on the last frame or this one still has to be reported,
+        # but moving the phase back must not repeat the last beat
+        while next_beat < now - 1 or next_beat - self.last_beat < self.period / 2:
+            next_beat += self.period
+        self.next_beat = next_beat
@@ -2,6 +2,22 @@ from app import Task
 
 
 class Output(Task):
+    # Output config keys that a reload can change without recreating the output
+    RECONFIGURABLE = ()
+
     def __init__(self, global_config, output_config, *args, **kwargs):
         super().__init__(output_config['NAME'], global_config, *args, **kwargs)
         self.output_config = output_config
+
+    def reconfigure(self, output_config):
+        """\
+        Apply a reloaded output config in place
+
+        Returns False if anything outside of RECONFIGURABLE changed, in which case the
+        output has to be recreated.
+        """
+        changed = set(k for k in set(self.output_config) | set(output_config) if self.output_config.get(k) != output_config.get(k))
+        if not changed <= set(self.RECONFIGURABLE):
+            return False
+        self.output_config = output_config
+        return True
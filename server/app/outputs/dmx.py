@@ -10,6 +10,7 @@ from dmxpy.DmxPy import DmxPy
 
 from app import Task
 from app.lib.misc import FPSCounter
+from app.lib.latency import record_latency
 
 
 logger = logging.getLogger(__name__)
@@ -92,6 +93,8 @@ def find_device_file(name):
 
 
 class DMX(Task):
+    CONSUMES = ('dmx', 'dmx_force')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -125,6 +128,17 @@ class DMX(Task):
 
         return self.dmx
 
+    def restart(self, data):
+        # Drop the device handle, get_dmx reopens it on the next frame
+        with self.dmx_lock:
+            if self.dmx:
+                try:
+                    self.dmx.serial.close()
+                except:
+                    logger.debug("Failed to close DMX device", exc_info=True)
+            self.dmx = None
+            self.dmx_attempt = None
+
     def run(self, data):
         dmx = self.get_dmx()
         if dmx:
@@ -132,6 +146,7 @@ class DMX(Task):
                 with self.fps:
                     for chan, val in data['dmx_force'].items():
                         dmx.setChannel(chan, val)
+                    record_latency(self.name + ':render', data)
                     dmx.render()
             if data.get('dmx'):
                 for chan, val in data['dmx'].items():
@@ -139,4 +154,5 @@ class DMX(Task):
             if time.time() - self.last_send >= self.delay:
                 self.last_send = time.time()
                 with self.fps:
+                    record_latency(self.name + ':render', data)
                     dmx.render()
@@ -1,6 +1,7 @@
-import random
 import time
 
+import numpy as np
+
 from app.outputs import Output
 from app.effects import Effect
 from app.lib.misc import FPSCounter
@@ -31,6 +32,9 @@ class BasicDMX(Output):
     RESET_ON_NEW_STATE: List of properties to reset to their value in INITIALIZE
         (or 0 if not present) when a new state is generated in the mapping
     MULTI_PROP_MAP: Dict mapping a multi-value property to the list of correct functions
+    RESPONSE_DELAY: Seconds from sending a new state until the light visibly reacts
+        (overridden by RESPONSE_DELAY in the output config).  With a tempo, beat
+        mappings fire this far ahead of the predicted beat so the light lands on it
     """
 
     FUNCTIONS = {}
@@ -42,6 +46,13 @@ class BasicDMX(Output):
     CLEAR_EFFECTS_ON_NEW_STATE = []
     RESET_ON_NEW_STATE = []
     MULTI_PROP_MAP = {}
+    RESPONSE_DELAY = 0.0
+
+    # Effects are time based, so fixtures run on every frame
+    ALWAYS_RUN = True
+
+    # Mappings and links are read on every frame, so a reload can swap them in place
+    RECONFIGURABLE = ('MAPPING', 'LINK', 'INITIALIZE', 'RESPONSE_DELAY')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -56,6 +67,28 @@ class BasicDMX(Output):
         self.effects = {}
         self.state_effect = None
         self.state_effects = self.get_state_effects()
+        # Where each function lands in the DMX universe
+        self.dmx_functions = list(self.FUNCTIONS.keys())
+        self.dmx_channels = np.array([self.FUNCTIONS[k] + self.output_config.get('ADDRESS', 1) - 1 for k in self.dmx_functions])
+        self.link_states = {}
+        # Predicted time of the last beat mappings were fired for
+        self.cued_beat = 0.0
+        self._declare_data()
+
+    def _declare_data(self):
+        # Linked lights push their state through the frame data, so they have to run
+        # after the light they are linked to
+        self.CONSUMES = ('audio', 'audio_channels', 'balance', 'is_onset', 'onset_strength', 'is_beat', 'bpm', 'next_beat_time', 'pitch', 'chroma', 'loudness_momentary', 'loudness_short_term', 'audio_v_sum', 'idle_for', 'dead_for', 'push_state__' + self.name)
+        self.PRODUCES = ('dmx', 'dmx_force')
+        if self.config.get('ENABLE_LINKS'):
+            self.PRODUCES += tuple('push_state__' + l['NAME'] for l in self.output_config.get('LINK') or [] if l.get('NAME'))
+
+    def reconfigure(self, output_config):
+        if not super().reconfigure(output_config):
+            return False
+        self.INITIALIZE = dict(type(self).INITIALIZE, **self.output_config.get('INITIALIZE', {}))
+        self._declare_data()
+        return True
 
     def start(self, data):
         self.state.update(self.INITIALIZE)
@@ -130,10 +163,28 @@ class BasicDMX(Output):
             send_monitor(self, 'EFFECT', opstate='DONE', opname=k, **self.effects[k].args)
             del self.effects[k]
 
+    def _beat_cue(self, data, now):
+        """\
+        Whether beat mappings fire this frame
+
+        With a tempo and a response delay, the next predicted beat is cued the response
+        delay ahead of it, once.  Otherwise mappings fire on the frame a beat is detected.
+        """
+        next_beat = data.get('next_beat_time')
+        delay = self.output_config.get('RESPONSE_DELAY', self.RESPONSE_DELAY)
+        if next_beat is None or not delay:
+            return bool(data.get('is_beat'))
+        # The prediction moves a little between frames, it's the same beat within half a period
+        if now < next_beat - delay or next_beat - self.cued_beat < 30.0 / data['bpm']:
+            return False
+        self.cued_beat = next_beat
+        return True
+
     def _run_mapping(self, data):
         config = self.output_config.get('MAPPING') or []
         now = time.time()
         new_state = {}
+        on_beat = self._beat_cue(data, now)
 
         for directive in config:
             arg_fn = getattr(self, 'map_' + directive['function'], None)
@@ -144,49 +195,72 @@ class BasicDMX(Output):
             value = None
             threshold = None
 
-            if data.get('audio') is not None and directive['trigger'] == 'frequency':
+            # Frequency triggers can use a single input channel's bins
+            audio = data.get('audio') if directive.get('channel') is None else data.get('audio_channels')
+            if audio is not None and directive.get('channel') is not None:
+                audio = audio[directive['channel']]
+
+            if audio is not None and directive['trigger'] == 'frequency':
                 value = []
                 for i in directive.get('bins') or []:
                     try:
                         iter(i)
                     except TypeError:
-                        value.append(data['audio'][i])
+                        value.append(audio[i])
                     else:
                         for j in range(i[0], i[1] + 1):
-                            value.append(data['audio'][j])
+                            value.append(audio[j])
                 if not value:
                     continue
                 # value = sum(value) / len(value)
                 value = max(value)
                 threshold = directive['threshold']
 
-            elif data.get('audio') is not None and directive['trigger'] == 'frequency_all':
+            elif audio is not None and directive['trigger'] == 'frequency_all':
                 if directive.get('bins'):
                     value = []
                     for bin_info in directive['bins']:
                         bucket = []
                         if isinstance(bin_info, list):
                             for idx in range(bin_info[0], bin_info[1] + 1):
-                                bucket.append(data['audio'][idx])
+                                bucket.append(audio[idx])
                         else:
-                            bucket.append([data['audio'][bin_info]])
+                            bucket.append([audio[bin_info]])
                         value.append(bucket)
                 else:
-                    value = data['audio']
+                    value = audio
                 threshold = directive.get('threshold', 0)
 
-            elif data.get('is_onset') and directive['trigger'] == 'onset':
-                value = random.random() / 1.5
-                threshold = 0
+            elif directive['trigger'] == 'onset':
+                # Strength of the onset in the directive's band, or in the strongest band
+                if directive.get('band'):
+                    value = data.get('onset__' + directive['band']) or None
+                elif data.get('is_onset'):
+                    value = data['onset_strength']
+                threshold = directive.get('threshold', 0)
 
-            elif data.get('is_beat') and directive['trigger'] == 'beat':
-                value = random.random() / 1.5
-                threshold = 0
+            elif on_beat and directive['trigger'] == 'beat':
+                # How hard the music hits on the beat
+                value = data.get('onset_strength') or 0.0
+                threshold = directive.get('threshold', 0)
 
             elif data.get('pitch') and directive['trigger'] == 'pitch':
                 value = data['pitch']
                 threshold = directive.get('threshold', 0)
 
+            elif data.get('chroma') is not None and directive['trigger'] == 'chroma':
+                value = data['chroma']
+                threshold = directive.get('threshold', 0)
+
+            elif directive['trigger'] == 'loudness' and data.get('loudness_' + directive.get('window', 'momentary')) is not None:
+                # 0 at -60 LUFS to 1 at 0 LUFS, like the other triggers
+                value = min(max(1.0 + data['loudness_' + directive.get('window', 'momentary')] / 60.0, 0.0), 1.0)
+                threshold = directive.get('threshold', 0)
+
+            elif data.get('balance') is not None and directive['trigger'] == 'balance':
+                value = data['balance']
+                threshold = directive.get('threshold', 0)
+
             if value is None or threshold is None:
                 continue
 
@@ -242,13 +316,13 @@ class BasicDMX(Output):
                     # TODO: log
                     continue
                 # Only push the auto state
-                linked_state = dict(self.auto_state)
+                linked_state = self.link_states.setdefault(linked['NAME'], {})
+                linked_state.update(self.auto_state)
                 for fn in linked.get('INVERT') or []:
                     linked_state[fn] = 255 - linked_state[fn]
-                data['push_state__' + linked.get('NAME')] = linked_state
+                data.push_state[linked['NAME']] = linked_state
 
         state = self.prep_dmx()
-        channels = {self.FUNCTIONS[chan] + self.output_config.get('ADDRESS', 1) - 1: val for chan, val in state.items()}
-        data.setdefault('dmx_force' if force else 'dmx', {}).update(channels)
+        (data.dmx_force if force else data.dmx).set(self.dmx_channels, [state[k] for k in self.dmx_functions])
         self.last_auto_state = dict(self.auto_state)
         self.last_state = dict(self.state)
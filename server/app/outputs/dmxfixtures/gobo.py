@@ -2,6 +2,7 @@ import random
 
 from app.effects import Effect
 from app.lib.misc import map_to_range
+from app.lib.chroma import chroma_hue
 
 from . import BasicDMX
 from .movinghead import MovingHeadMixin
@@ -21,6 +22,11 @@ class GoboMixin:
         }
 
     def _map_pan_tilt(self, function, trigger, value, threshold):
+        if trigger == 'balance':
+            # Point at where the sound is, -1 (left) to 1 (right)
+            if abs(value) >= threshold:
+                return int(round((value + 1) * 127.5))
+            return
         if value < threshold:
             return
         cur_value = self.auto_state[function]
@@ -38,6 +44,12 @@ class GoboMixin:
         return self._map_pan_tilt('tilt', trigger, value, threshold)
 
     def map_color(self, trigger, value, threshold):
+        if trigger == 'chroma':
+            # A slot of the wheel for every region of the circle of fifths
+            hue, strength = chroma_hue(value)
+            if strength >= threshold:
+                return int(hue * 57)
+            return
         if value >= threshold:
             half_color = random.random() > 0.75
             if half_color:
@@ -1,8 +1,10 @@
+import colorsys
 import random
 import time
 
 from app.effects import Effect, StateEffect
 from app.lib.misc import map_to_range
+from app.lib.chroma import chroma_hue, pitch_class_hue
 
 from . import BasicDMX
 
@@ -158,6 +160,11 @@ class TomshineMovingHead6in1(MovingHeadMixin, BasicDMX):
         return random.choice(choices)
 
     def map_pan(self, trigger, value, threshold):
+        if trigger == 'balance':
+            # Point at where the sound is, -1 (left) to 1 (right)
+            if abs(value) >= threshold:
+                return int(round((value + 1) * 127.5))
+            return
         return self._map_pan_tilt('pan', value, threshold)
 
     def map_tilt(self, trigger, value, threshold):
@@ -190,11 +197,20 @@ class TomshineMovingHead6in1(MovingHeadMixin, BasicDMX):
                 # return curr
             return None
 
+        if trigger == 'chroma':
+            # Related harmonies get related colors, the threshold is how clearly the
+            # chroma has to point at one
+            hue, strength = chroma_hue(value)
+            if strength < threshold:
+                return
+            return [int(c * 255) for c in colorsys.hsv_to_rgb(hue, 1.0, 1.0)]
+
         if value < threshold:
             return
 
         if trigger == 'pitch':
-            return int((value / 128) * 255), 0, 0
+            # Notes a fifth apart get neighbouring colors, in every octave
+            return [int(c * 255) for c in colorsys.hsv_to_rgb(pitch_class_hue(value), 1.0, 1.0)]
 
         old_rgb = [self.auto_state[k] for k in ('red', 'green', 'blue')]
         diff = 0
@@ -14,6 +14,8 @@ from app import Task
 
 
 class GUI(Task):
+    CONSUMES = ('audio', 'led_pixels')
+
     def start(self, data):
         super().start(data)
         self.fft_plot_filter = ExpFilter(np.tile(1e-1, self.config['N_FFT_BINS']),
@@ -10,6 +10,7 @@ from . import Output
 from app.effects import Effect
 from app.lib.dsp import ExpFilter
 from app.lib.misc import FPSCounter
+from app.lib.latency import record_latency
 
 
 logger = logging.getLogger()
@@ -254,6 +255,10 @@ class IdleAdvancedFlameEffect(object):
 
 
 class BaseLEDStrip(Output):
+    CONSUMES = ('audio',)
+    PRODUCES = ('led_pixels',)
+    RECONFIGURABLE = ('EFFECT', 'IDLE')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -287,11 +292,17 @@ class BaseLEDStrip(Output):
         #         # If we're fading out on idle, don't apply the idle effect until afterwards
         #         subscribe('idle_for', self.handle_idle_for, condition=lambda e, t, *a, **ka: t and t > self.output_config['IDLE']['FADEOUT'])
 
-    def visualize_scroll(self, y):
-        """Effect that originates in the center and scrolls outwards"""
-        y = y**2.0
+    def _normalize(self, y):
+        # Quantile normalized bins are already 0-1, each in its own range
+        if self.config.get('MEL_NORMALIZATION', 'gain') == 'quantile':
+            return y
         self.gain.update(y)
         y /= self.gain.value
+        return y
+
+    def visualize_scroll(self, y):
+        """Effect that originates in the center and scrolls outwards"""
+        y = self._normalize(y**2.0)
         y *= 255.0
         r = int(np.max(y[:len(y) // 3]))
         g = int(np.max(y[len(y) // 3: 2 * len(y) // 3]))
@@ -309,9 +320,7 @@ class BaseLEDStrip(Output):
 
     def visualize_energy(self, y):
         """Effect that expands from the center with increasing sound energy"""
-        y = np.copy(y)
-        self.gain.update(y)
-        y /= self.gain.value
+        y = self._normalize(np.copy(y))
         # Scale by the width of the LED strip
         y *= float((self.output_config['N_PIXELS'] // 2) - 1)
         # Map color channels according to energy in the different freq bands
@@ -424,6 +433,9 @@ class BaseLEDStrip(Output):
 
 
 class RemoteStrip(BaseLEDStrip):
+    # The address is read on every send, so the socket is kept
+    RECONFIGURABLE = BaseLEDStrip.RECONFIGURABLE + ('HOST', 'PORT')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -459,6 +471,7 @@ class RemoteStrip(BaseLEDStrip):
         idx = np.array_split(idx, n_packets)
         if self._retry_at is None or self._retry_at <= time.time():
             self._retry_at = None
+            record_latency(self.name + ':send', data)
             try:
                 for packet_indices in idx:
                     m = []
@@ -474,5 +487,5 @@ class RemoteStrip(BaseLEDStrip):
                     logger.warning("Can't send data to led strip at %s:%d", self.output_config['HOST'], self.output_config['PORT'], exc_info=True)
                     self._retry_at = time.time() + 5
 
-        data.setdefault('led_pixels', {})[self.name] = self.pixels
+        data.led_pixels[self.name] = self.pixels
         self._prev_pixels = np.copy(self.pixels)
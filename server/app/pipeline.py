@@ -0,0 +1,143 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from app import Task
+from app.lib.latency import record_latency
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskGroup(Task):
+    """\
+    Runs a set of independent tasks concurrently on a thread pool
+
+    Tasks in a group must not read anything another task in the group writes during
+    the same frame, and must write disjoint fields of the frame context.  The group
+    returns once every task has finished, so the rest of the pipeline sees the same
+    data as if the tasks had run one after another.
+
+    This only pays off for tasks that spend their time in code that releases the GIL
+    (NumPy/SciPy transforms).
+    """
+
+    def __init__(self, name, config, tasks, workers=None, *args, **kwargs):
+        super().__init__(name, config, *args, **kwargs)
+        self.tasks = list(tasks)
+        self.workers = workers or len(self.tasks)
+        self.executor = None
+        self.CONSUMES = tuple(k for t in self.tasks for k in t.CONSUMES)
+        self.PRODUCES = tuple(k for t in self.tasks for k in t.PRODUCES)
+
+    def start(self, data):
+        for t in self.tasks:
+            t.start(data)
+        self.start_pool()
+
+    def stop(self):
+        self.stop_pool()
+        for t in self.tasks:
+            t.stop()
+
+    def start_pool(self):
+        """Start the worker threads, without starting the tasks (they may already be running)"""
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+
+    def stop_pool(self):
+        """Stop the worker threads, leaving the tasks running (when the pipeline is rebuilt)"""
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    def restart(self, data):
+        # A hung worker thread can't be killed, leave it behind with the old pool
+        self.executor.shutdown(wait=False)
+        for t in self.tasks:
+            t.restart(data)
+        self.start_pool()
+
+    def should_run(self, data):
+        return any(t.should_run(data) for t in self.tasks)
+
+    def _run_task(self, task, data):
+        task.run(data)
+        record_latency(task.name, data)
+
+    def run(self, data):
+        futures = [self.executor.submit(self._run_task, t, data) for t in self.tasks if t.should_run(data)]
+        # Join everything first - an exception from one task (NoData included) is only
+        # raised once the others are done with the frame data
+        wait(futures)
+        for f in futures:
+            f.result()
+
+
+def build_pipeline(tasks, config):
+    """\
+    Order tasks by the data they consume and produce
+
+    Tasks are split into stages: every task runs in the first stage after all of the
+    tasks producing something it consumes.  Within a stage tasks keep the order they
+    were given in.  If PROCESSOR_WORKERS is set, processors in a stage that write
+    disjoint keys are wrapped in a TaskGroup and run concurrently; inputs and outputs
+    (sockets, serial devices) always run on the main loop.
+
+    Raises ValueError for dependency cycles.  A task that consumes only data nothing
+    in the pipeline produces is kept (it is still started and stopped, eg. outputs
+    driven by manual control, or the DMX sender without fixtures), but a warning is
+    logged since it will never run.
+    """
+    producers = {}
+    for t in tasks:
+        for key in t.PRODUCES:
+            producers.setdefault(key, []).append(t)
+
+    deps = {}
+    for t in tasks:
+        missing = [k for k in t.CONSUMES if k not in producers]
+        if missing and len(missing) == len(t.CONSUMES) and not t.ALWAYS_RUN:
+            logger.warning("Task %s consumes %s but nothing produces it, it will not run", t.name, ', '.join(missing))
+        elif missing:
+            logger.debug("Task %s consumes %s but nothing produces it", t.name, ', '.join(missing))
+        deps[t] = set(p for k in t.CONSUMES for p in producers.get(k, []) if p is not t)
+
+    stages = []
+    done = set()
+    remaining = list(tasks)
+    while remaining:
+        stage = [t for t in remaining if deps[t] <= done]
+        if not stage:
+            raise ValueError("Circular dependency between tasks: " + ', '.join(t.name for t in remaining))
+        stages.append(stage)
+        done.update(stage)
+        remaining = [t for t in remaining if t not in done]
+
+    workers = config.get('PROCESSOR_WORKERS')
+    if workers:
+        # Not at the top, the processors' libraries are only loaded if they are used
+        from app.processors import Processor
+    pipeline = []
+    for i, stage in enumerate(stages):
+        group = []
+        serial = []
+        produced = set()
+        for t in stage:
+            # Tasks with undeclared output may have side effects that need the main
+            # thread (the GUI), and tasks sharing an output key would race on it
+            if workers and isinstance(t, Processor) and t.PRODUCES and not produced & set(t.PRODUCES):
+                group.append(t)
+                produced.update(t.PRODUCES)
+            else:
+                serial.append(t)
+
+        if len(group) > 1:
+            pipeline.append(TaskGroup(f'stage{i}', config, group, workers=workers))
+            pipeline.extend(serial)
+        else:
+            pipeline.extend(stage)
+
+    logger.info("Pipeline: %s", ' -> '.join(
+        '[' + ' | '.join(s.name for s in t.tasks) + ']' if isinstance(t, TaskGroup) else t.name
+        for t in pipeline
+    ))
+    return pipeline
@@ -1,78 +1,193 @@
 import time
+import logging
+from collections import deque
 
 import numpy as np
 from scipy.ndimage.filters import gaussian_filter1d
-import aubio
 
 from app import Task
-from app.lib.dsp import create_mel_bank, ExpFilter
+from app.lib.dsp import create_mel_bank, ExpFilter, SparseMelBank, PeakPicker, RunningMean, StreamingQuantiles, k_weighting
+from app.lib.fft import RollingFFT, rfft_backend, fft_size
+from app.lib.tempo import TempoTracker
+from app.lib.chroma import chroma_map, key_templates, chord_templates, harmony_name
 from app.lib.misc import FPSCounter
 from app.lib.network import send_monitor
 
 
+logger = logging.getLogger(__name__)
+
+
 class Processor(Task):
     pass
 
 
+class SpectrumProcessor(Processor):
+    """\
+    Windowed FFT of the raw audio, shared by the other processors
+
+    Every frame is appended to a rolling window of N_ROLLING_HISTORY frames per
+    channel, which is transformed on FFT_BACKEND (numpy or scipy, with FFT_WORKERS
+    threads) over buffers allocated once, see RollingFFT.  spectrum holds the
+    magnitudes (channels x bins) and spectrum_level the peak level of the window
+    (0-1), with one row for every frame of a batch.
+    """
+
+    CONSUMES = ('raw_channels',)
+    PRODUCES = ('spectrum', 'spectrum_level')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fps = FPSCounter('Spectrum Processor')
+        batch = self.config.get('INPUT_BATCH', 8) if self.config.get('INPUT_POLICY') == 'batch' else 1
+        self.fft = RollingFFT(int(self.config['MIC_RATE'] / self.config['FPS']), self.config['N_ROLLING_HISTORY'],
+                              self.config.get('INPUT_CHANNELS', 1), batch=batch,
+                              backend=self.config['FFT_BACKEND'], workers=self.config['FFT_WORKERS'])
+
+    def check_config(self, config, keys):
+        if keys & {'FFT_BACKEND', 'FFT_WORKERS'}:
+            rfft_backend(config['FFT_BACKEND'], config['FFT_WORKERS'])
+
+    def config_changed(self, keys):
+        if keys & {'FFT_BACKEND', 'FFT_WORKERS'}:
+            self.fft.rfft = rfft_backend(self.config['FFT_BACKEND'], self.config['FFT_WORKERS'])
+
+    def run(self, data):
+        if data.get('raw_channels') is None:
+            return
+        frames = data.batch()
+        with self.fps:
+            levels = data.buffer('spectrum_level')[-len(frames):]
+            for i, frame in enumerate(frames):
+                levels[i] = self.fft.push(frame)
+                self.fft.window_into(i)
+            self.fft.transform(data.buffer('spectrum')[-len(frames):])
+
+
 class SmoothingProcessor(Processor):
+    """\
+    Turns the spectrum into smoothed mel spectrum bins
+
+    Every channel goes through the mel filterbank together, as one 2-D
+    operation.  audio is the mean of the channels' mel spectra.  With more than one
+    input channel, the per channel spectra are also published in audio_channels
+    (normalized with the same gain, so channels can be compared), and balance is the
+    energy balance between channels 0 (left) and 1 (right): -1 is all left, 1 is all
+    right.  mel is the unnormalized mel power spectrum, averaged over the channels,
+    for the processors that need the actual levels.
+
+    MEL_NORMALIZATION picks how the bins are brought to 0-1.  gain divides them all
+    by one gain following the loudest bin, so a loud kick pushes every other band
+    down for a while.  quantile maps every bin from its own typical level to its own
+    loud level (the running MEL_QUANTILES of that bin), so a value means the same in
+    every band, track and room.
+
+    When the input hands over a batch of frames it fell behind on, they go through the
+    filterbank together and the filters advance one step per frame, but only the
+    newest frame's spectrum is published.
+    """
+
+    CONSUMES = ('spectrum', 'spectrum_level')
+    PRODUCES = ('audio', 'mel')
+
+    # How many times its typical level a bin's loud level has to have been, before
+    # quantile normalization lets it out of 0
+    QUANTILE_WARM_SPREAD = 1.25
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fps = FPSCounter('Smoothing Processor')
-        self.samples_per_frame = int(self.config['MIC_RATE'] / self.config['FPS'])
-        self.y_roll = np.random.rand(self.config['N_ROLLING_HISTORY'], self.samples_per_frame) / 1e16
-        self.fft_window = np.hamming(int(self.config['MIC_RATE'] / self.config['FPS']) * self.config['N_ROLLING_HISTORY'])
+        self.channels = self.config.get('INPUT_CHANNELS', 1)
+        if self.channels > 1:
+            self.PRODUCES = ('audio', 'mel', 'audio_channels', 'balance')
         self.mel_y, self.mel_x = create_mel_bank(self.config)
+        self.mel_bank = self._mel_bank()
         self.mel_gain = ExpFilter(np.tile(1e-1, self.config['N_FFT_BINS']),
                          alpha_decay=0.01, alpha_rise=0.99)
+        self.mel_quantiles = None
+        if self.config.get('MEL_NORMALIZATION', 'gain') == 'quantile':
+            self.mel_quantiles = StreamingQuantiles(self.config['MEL_QUANTILES'])
+            self.mel_warm = np.zeros(self.config['N_FFT_BINS'], dtype=bool)
         self.mel_smoothing = ExpFilter(np.tile(1e-1, self.config['N_FFT_BINS']),
                          alpha_decay=0.5, alpha_rise=0.99)
+        self.channel_smoothing = ExpFilter(np.tile(1e-1, (self.channels, self.config['N_FFT_BINS'])),
+                         alpha_decay=0.5, alpha_rise=0.99)
+        self.balance = ExpFilter(0.0, alpha_decay=0.1, alpha_rise=0.1)
 
         self.net_send_samples = []
         self.net_send_rate = 0.05
         self.net_send_time = time.time()
 
+    def check_config(self, config, keys):
+        if keys & {'MIN_FREQUENCY', 'MAX_FREQUENCY'}:
+            create_mel_bank(config)
+
+    def config_changed(self, keys):
+        # The filters are sized by N_FFT_BINS, which needs a restart, so they keep their state
+        if keys & {'MIN_FREQUENCY', 'MAX_FREQUENCY'}:
+            self.mel_y, self.mel_x = create_mel_bank(self.config)
+            self.mel_bank = self._mel_bank()
+
+    def _mel_bank(self):
+        # The mel bank covers the first half of the unpadded window's bins, the rest
+        # of the spectrum is left out
+        n_bins = fft_size(int(self.config['MIC_RATE'] / self.config['FPS']), self.config['N_ROLLING_HISTORY']) // 2 + 1
+        return SparseMelBank(np.pad(self.mel_y, ((0, 0), (0, n_bins - self.mel_y.shape[1]))))
+
+    def _normalize(self, mono, mel):
+        # Brings the active frames' bins to 0-1, mono and per channel alike
+        if self.mel_quantiles is None:
+            gain = self.mel_gain.update_many(np.max(gaussian_filter1d(mono, sigma=1.0, axis=1), axis=1))
+            return mono / gain, mel / gain[:, None]
+
+        floor, ceiling = np.empty_like(mono), np.empty_like(mono)
+        for i, frame in enumerate(mono):
+            floor[i], ceiling[i] = self.mel_quantiles.update(frame).T
+        # Both estimates start at the first frame, a bin is held at 0 until they have
+        # spread apart for the first time
+        warm = np.logical_or.accumulate(np.vstack((self.mel_warm, ceiling >= self.QUANTILE_WARM_SPREAD * floor)))[1:]
+        self.mel_warm = warm[-1]
+        scale = np.where(warm, np.maximum(ceiling - floor, StreamingQuantiles.FLOOR), np.inf)
+        return (np.clip((mono - floor) / scale, 0.0, 1.0),
+                np.clip((mel - floor[:, None]) / scale[:, None], 0.0, 1.0))
+
     def run(self, data):
-        audio_samples = data.get('raw_audio')
-        if audio_samples is None:
+        if data.get('spectrum') is None:
             return
+        spectra = data.batch('spectrum')
         with self.fps:
-            # Normalize samples between 0 and 1
-            y = audio_samples / 2.0**15
-            # Construct a rolling window of audio samples
-            self.y_roll[:-1] = self.y_roll[1:]
-            self.y_roll[-1, :] = np.copy(y)
-            y_data = np.concatenate(self.y_roll, axis=0).astype(np.float32)
-
-            output = None
-
-            vol = np.max(np.abs(y_data))
-            if vol < self.config['MIN_VOLUME_THRESHOLD']:
-                # print('No audio input. Volume below threshold. Volume:', vol)
-                output = np.tile(0, self.config['N_FFT_BINS']).astype(float)
-            else:
-                # Transform audio input into the frequency domain
-                N = len(y_data)
-                N_zeros = 2**int(np.ceil(np.log2(N))) - N
-                # Pad with zeros until the next power of two
-                y_data *= self.fft_window
-                y_padded = np.pad(y_data, (0, N_zeros), mode='constant')
-                YS = np.abs(np.fft.rfft(y_padded)[:N // 2])
-                # Construct a Mel filterbank from the FFT data
-                mel = np.atleast_2d(YS).T * self.mel_y.T
-                # Scale data to values more suitable for visualization
-                # mel = np.sum(mel, axis=0)
-                mel = np.sum(mel, axis=0)
-                mel = mel**2.0
-                # Gain normalization
-                self.mel_gain.update(np.max(gaussian_filter1d(mel, sigma=1.0)))
-                mel /= self.mel_gain.value
-                mel = self.mel_smoothing.update(mel)
-                output = mel
-
-            if output is not None:
-                data['audio'] = output
-
-            self.net_send_samples.append(list(output))
+            # Frames below the threshold don't move the filters (except the balance)
+            active = data.batch('spectrum_level') >= self.config['MIN_VOLUME_THRESHOLD']
+            # Construct a Mel filterbank from the FFT data, for every frame and channel at once
+            mel = self.mel_bank.apply(spectra)
+            # Scale data to values more suitable for visualization
+            mel **= 2.0
+            mono = mel[:, 0] if self.channels == 1 else mel.mean(axis=1)
+            np.copyto(data.buffer('mel')[-len(spectra):], mono)
+
+            balance = np.zeros(len(spectra))
+            if active.any():
+                if not active.all():
+                    mel, mono = mel[active], mono[active]
+                normalized, normalized_channels = self._normalize(mono, mel)
+                output = self.mel_smoothing.update_many(normalized)[-1]
+                if self.channels > 1:
+                    channels = self.channel_smoothing.update_many(normalized_channels)[-1]
+                    energy = mel.sum(axis=2)
+                    total = energy[:, 0] + energy[:, 1]
+                    balance[active] = np.divide(energy[:, 1] - energy[:, 0], total, out=np.zeros_like(total), where=total > 0)
+            balance = self.balance.update_many(balance)[-1]
+
+            if not active[-1]:
+                # print('No audio input. Volume below threshold.')
+                output = 0.0
+                channels = 0.0
+
+            np.copyto(data.buffer('audio'), output)
+            if self.channels > 1:
+                np.copyto(data.buffer('audio_channels'), channels)
+                data['balance'] = float(balance)
+
+            self.net_send_samples.append(list(data['audio']))
             if time.time() - self.net_send_time >= self.net_send_rate:
                 self.net_send_time = time.time()
                 net_data = [sum((self.net_send_samples[i][b] for i in range(len(self.net_send_samples)))) / len(self.net_send_samples) for b in range(len(self.net_send_samples[0]))]
@@ -80,64 +195,386 @@ class SmoothingProcessor(Processor):
                 self.net_send_samples = []
 
 
-class BeatProcessor(Processor):
+def mono_spectra(data):
+    """Magnitude spectrum of every frame in the batch, averaged over the channels"""
+    spectra = data.batch('spectrum')
+    return spectra[:, 0] if spectra.shape[1] == 1 else spectra.mean(axis=1)
+
+
+class OnsetProcessor(Processor):
+    """\
+    Multiband spectral flux onset detection on the mel spectrum
+
+    ONSET_BANDS names frequency ranges, eg. bass: [20, 150], and defaults to
+    DEFAULT_BANDS over MIN_FREQUENCY-MAX_FREQUENCY.  The flux of a band is the mean
+    rise in log mel power over the mel bins centered in it (or the closest bin, if
+    the band is too narrow to have any), and onsets are
+    picked from the flux of every band at once with an adaptive threshold, the
+    median of the last half second plus ONSET_THRESHOLD times its mean.  A
+    band's strength is its flux relative to its recent peak flux, 0-1.
+
+    onset__<band> is the strength of the band's onset this frame (0 without one),
+    onset_time__<band> the capture time of the band's latest onset, onset_strength
+    the strongest band's strength whether it had an onset or not, and is_onset
+    whether any band had one.  Frames below MIN_VOLUME_THRESHOLD have no onsets.
+    """
+
+    CONSUMES = ('mel', 'spectrum_level')
+    PRODUCES = ('is_onset', 'onset_strength', 'onset', 'onset_time')
+
+    # Default bands and their upper edges in Hz, the first starts at MIN_FREQUENCY and
+    # the last ends at MAX_FREQUENCY
+    DEFAULT_BANDS = (('bass', 150), ('mid', 2500), ('high', None))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fps = FPSCounter('Beat Processor')
-        self.win_s = 1024
-        self.hop_s = self.frames_per_buffer = int(self.config['MIC_RATE'] / self.config['FPS'])
-        self.onset_detect = aubio.onset('energy', self.win_s, self.hop_s, self.config['MIC_RATE'])
-        self.beat_detect = aubio.tempo('hfc', self.win_s, self.hop_s, self.config['MIC_RATE'])
+        self.fps = FPSCounter('Onset Processor')
+        self.last_mel = None
+        self.onset_times = {}
+        self._setup_bands()
+
+    @classmethod
+    def _bands(cls, config):
+        if config.get('ONSET_BANDS'):
+            return config['ONSET_BANDS']
+        low, high = config['MIN_FREQUENCY'], config['MAX_FREQUENCY']
+        bands = {}
+        for name, edge in cls.DEFAULT_BANDS:
+            top = high if edge is None else min(max(edge, low), high)
+            bands[name] = [low, top]
+            low = top
+        return bands
+
+    @classmethod
+    def _band_weights(cls, config):
+        # Returns the band names and the mel bins x bands averaging weights
+        mel_y, _ = create_mel_bank(config)
+        n_fft = fft_size(int(config['MIC_RATE'] / config['FPS']), config['N_ROLLING_HISTORY'])
+        # Center of every mel bin, from the FFT bin its filter peaks at
+        centers = np.argmax(mel_y, axis=1) * config['MIC_RATE'] / float(n_fft)
+
+        bands = cls._bands(config)
+        weights = np.zeros((len(centers), len(bands)))
+        for i, (name, (low, high)) in enumerate(bands.items()):
+            members = (centers >= low) & (centers < high)
+            if not members.any():
+                # Closest on a log scale to the middle of the band
+                middle = np.sqrt(max(low, 1.0) * max(high, 1.0))
+                closest = np.argmin(np.abs(np.log2(np.maximum(centers, 1.0) / middle)))
+                logger.warning("Onset band %s (%s-%s Hz) has no mel bins, using the one at %d Hz", name, low, high, centers[closest])
+                members = np.arange(len(centers)) == closest
+            weights[members, i] = 1.0 / np.count_nonzero(members)
+        return list(bands), weights
+
+    def _setup_bands(self):
+        self.bands, self.band_weights = self._band_weights(self.config)
+
+        fps = self.config['FPS']
+        self.picker = PeakPicker(max(3, fps // 2), bands=len(self.bands), threshold=self.config['ONSET_THRESHOLD'],
+                                 min_interval=max(1, fps // 20))
+        # Follows the peaks closely and lets go of them over a few seconds
+        self.peak_flux = ExpFilter(np.tile(1e-3, len(self.bands)), alpha_decay=0.002, alpha_rise=0.9)
+
+    def check_config(self, config, keys):
+        if keys & {'ONSET_BANDS', 'MIN_FREQUENCY', 'MAX_FREQUENCY'}:
+            self._band_weights(config)
+
+    def config_changed(self, keys):
+        if keys & {'ONSET_BANDS', 'ONSET_THRESHOLD', 'MIN_FREQUENCY', 'MAX_FREQUENCY'}:
+            self._setup_bands()
 
     def run(self, data):
-        audio_samples = data.get('raw_audio')
-        if audio_samples is None:
+        if data.get('mel') is None:
             return
         with self.fps:
+            log_mel = np.log1p(data.batch('mel'))
+            if self.last_mel is None:
+                self.last_mel = log_mel[0]
+            rise = np.maximum(np.diff(log_mel, axis=0, prepend=self.last_mel[None]), 0.0)
+            self.last_mel = log_mel[-1]
+            flux = rise.dot(self.band_weights)
+
+            # Every frame of a batch goes through the detector to keep its state
+            # continuous, the strongest onset of each band counts
+            levels = data.batch('spectrum_level')
+            now = data.get('capture_time') or time.time()
+            onsets = np.zeros(len(self.bands))
+            strength = 0.0
+            for i, band_flux in enumerate(flux):
+                fired = self.picker.update(band_flux)[0]
+                strengths = np.minimum(band_flux / self.peak_flux.update(band_flux), 1.0)
+                if levels[i] < self.config['MIN_VOLUME_THRESHOLD']:
+                    continue
+                strength = max(strength, strengths.max())
+                if fired.any():
+                    np.maximum(onsets, np.where(fired, strengths, 0.0), out=onsets)
+                    onset_time = now - (len(flux) - 1 - i) / float(self.config['FPS'])
+                    self.onset_times.update((self.bands[b], onset_time) for b in np.flatnonzero(fired))
+
+            for name, value in zip(self.bands, onsets.tolist()):
+                data['onset__' + name] = value
+            for name, onset_time in self.onset_times.items():
+                data['onset_time__' + name] = onset_time
             data.update({
-                'is_onset': True if self.onset_detect(audio_samples) else False,
-                'is_beat': True if self.beat_detect(audio_samples) else False,
+                'is_onset': bool(onsets.any()),
+                'onset_strength': float(strength),
                 })
 
-            # if is_onset:
-            #     # print("onset", self.onset_detect.get_last_s())
-            #     send_to('@output', 'onset')
-            # # if is_beat:
-            # #     print("beat", self.beat_detect.get_last_s())
+
+class BeatProcessor(Processor):
+    """\
+    Detects beats in the shared spectrum
+
+    Beats are predicted by a TempoTracker following the rises in log energy, which
+    keeps it on the kick and bass rather than broadband noise.  Besides is_beat, the
+    tempo is published as bpm, beat_phase (how far into the current beat the
+    newest frame is, 0-1) and next_beat_time (the capture time the next beat is
+    predicted at), so outputs can act ahead of the beat.  Frames below
+    MIN_VOLUME_THRESHOLD have no beats, and none of these are set without a tempo.
+    """
+
+    CONSUMES = ('spectrum', 'spectrum_level', 'capture_time')
+    PRODUCES = ('is_beat', 'bpm', 'beat_phase', 'next_beat_time')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fps = FPSCounter('Beat Processor')
+        self.tempo = TempoTracker(self.config['FPS'])
+        self.last_energy = None
+
+    def run(self, data):
+        if data.get('spectrum') is None:
+            return
+        with self.fps:
+            spectra = mono_spectra(data)
+            energy = np.square(spectra, dtype=np.float64).sum(axis=1)
+            # Compressed so the tempo follows rhythm rather than loudness
+            log_energy = np.log1p(energy)
+            if self.last_energy is None:
+                self.last_energy = log_energy[0]
+            rise = np.maximum(np.diff(log_energy, prepend=self.last_energy), 0.0)
+            self.last_energy = log_energy[-1]
+
+            # Every frame of a batch goes through the tracker to keep its state
+            # continuous, a beat in any of them counts
+            is_beat = False
+            for i, active in enumerate(data.batch('spectrum_level') >= self.config['MIN_VOLUME_THRESHOLD']):
+                is_beat = self.tempo.update(rise[i]) and active or is_beat
+            data['is_beat'] = bool(is_beat)
+
+            if self.tempo.period and active:
+                now = data.get('capture_time') or time.time()
+                data.update({
+                    'bpm': float(self.tempo.bpm),
+                    'beat_phase': float(self.tempo.phase),
+                    'next_beat_time': float(now + self.tempo.frames_to_beat / self.config['FPS']),
+                    })
+            else:
+                data.update({'bpm': None, 'beat_phase': None, 'next_beat_time': None})
 
 
 class PitchProcessor(Processor):
+    """\
+    Estimates the pitch (as a MIDI note) from the shared spectrum
+
+    The fundamental is the peak of the harmonic product spectrum over the first
+    HARMONICS harmonics, between MIN_PITCH and MAX_PITCH Hz, refined by parabolic
+    interpolation.  It is only kept when those harmonics hold at least MIN_CONFIDENCE
+    of the spectrum's energy; pitch is the average of the last few kept estimates.
+    """
+
+    CONSUMES = ('spectrum', 'spectrum_level')
+    PRODUCES = ('pitch',)
+
+    HARMONICS = 3
+    MIN_PITCH = 60
+    MAX_PITCH = 2000
+    MIN_CONFIDENCE = 0.3
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fps = FPSCounter('Pitch Processor')
-        self.win_s = 1024
-        self.hop_s = self.frames_per_buffer = int(self.config['MIC_RATE'] / self.config['FPS'])
-        self.pitch_detect = aubio.pitch('yin', self.win_s, self.hop_s, self.config['MIC_RATE'])
-        self.pitch_detect.set_unit('midi')
-        # self.pitch_detect.set_tolerance(1)
-        self.buffer = []
-        self.buffer_len = 3
+        self.n_fft = fft_size(int(self.config['MIC_RATE'] / self.config['FPS']), self.config['N_ROLLING_HISTORY'])
+        self.bin_hz = self.config['MIC_RATE'] / float(self.n_fft)
+        n_bins = self.n_fft // 2 + 1
+        # Candidate fundamentals, and the bins of their harmonics
+        candidates = np.arange(max(2, int(self.MIN_PITCH / self.bin_hz)),
+                               min(int(self.MAX_PITCH / self.bin_hz), (n_bins - 2) // self.HARMONICS) + 1)
+        self.harmonic_bins = candidates[None, :] * np.arange(1, self.HARMONICS + 1)[:, None]
+        # The last few kept estimates
+        self.buffer = deque(maxlen=3)
 
     def run(self, data):
-        audio_samples = data.get('raw_audio')
-        if audio_samples is None:
+        if data.get('spectrum') is None:
             return
         with self.fps:
-            pitch = self.pitch_detect(audio_samples)[0]
-            confidence = self.pitch_detect.get_confidence()
-            # print('{:1.5f} {:s}'.format(confidence, '*' * int(pitch)))
-            if confidence > 0:
-                self.buffer.append(pitch)
-                self.buffer = self.buffer[-self.buffer_len:]
-
-            if len(self.buffer) == self.buffer_len:
+            levels = data.batch('spectrum_level')
+            for spectrum, level in zip(mono_spectra(data), levels):
+                if level < self.config['MIN_VOLUME_THRESHOLD']:
+                    continue
+                pitch, confidence = self._estimate(spectrum)
+                if confidence >= self.MIN_CONFIDENCE:
+                    self.buffer.append(pitch)
+
+            if len(self.buffer) == self.buffer.maxlen:
                 avg = sum(self.buffer) / len(self.buffer)
                 data['pitch'] = avg
             else:
                 data['pitch'] = None
 
+    def _estimate(self, spectrum):
+        """Returns the pitch as a (fractional) MIDI note, and the confidence"""
+        power = spectrum.astype(np.float64)**2
+        total = power.sum()
+        if not total:
+            return 0.0, 0.0
+        hps = spectrum[self.harmonic_bins].prod(axis=0)
+        fundamental = self.harmonic_bins[0, np.argmax(hps)]
+        a, b, c = spectrum[fundamental - 1:fundamental + 2]
+        # Only interpolate around a peak of the spectrum itself
+        offset = 0.5 * (a - c) / (a - 2 * b + c) if b >= max(a, c) and a - 2 * b + c < 0 else 0.0
+
+        harmonics = fundamental * np.arange(1, self.HARMONICS + 1)
+        harmonic_power = sum(power[h - 1:h + 2].sum() for h in harmonics)
+        pitch = 69 + 12 * np.log2((fundamental + offset) * self.bin_hz / 440.0)
+        return float(pitch), harmonic_power / total
+
+
+class ChromaProcessor(Processor):
+    """\
+    Folds the shared spectrum into a chroma vector, and follows the key and chord
+
+    The magnitudes between CHROMA_MIN_HZ and CHROMA_MAX_HZ are summed into the 12
+    pitch classes (C first) through a bin to pitch class map built once, for every
+    frame of the batch at once.  Each frame's chroma is scaled to a peak of 1 so
+    loudness doesn't matter, and smoothed twice: over a fraction of a second for
+    chroma and the chord, the best matching major or minor triad (if it matches
+    well enough), and over several seconds for the key, the best correlated
+    Krumhansl-Kessler key profile.  Frames below MIN_VOLUME_THRESHOLD are skipped.
+    """
+
+    CONSUMES = ('spectrum', 'spectrum_level')
+    PRODUCES = ('chroma', 'chord', 'key')
+
+    # Range folded into the chroma, in Hz; below it a bin spans several semitones
+    CHROMA_MIN_HZ = 250
+    CHROMA_MAX_HZ = 5000
+    # Cosine similarity between the chroma and the chord's triad
+    MIN_CHORD_MATCH = 0.6
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fps = FPSCounter('Chroma Processor')
+        n_fft = fft_size(int(self.config['MIC_RATE'] / self.config['FPS']), self.config['N_ROLLING_HISTORY'])
+        self.first_bin, self.chroma_map = chroma_map(n_fft, self.config['MIC_RATE'], self.CHROMA_MIN_HZ, self.CHROMA_MAX_HZ)
+        self.last_bin = self.first_bin + len(self.chroma_map)
+        self.key_templates = key_templates()
+        self.chord_templates = chord_templates()
+        self.chord_chroma = ExpFilter(np.zeros(12), alpha_decay=0.2, alpha_rise=0.2)
+        self.key_chroma = ExpFilter(np.zeros(12), alpha_decay=0.002, alpha_rise=0.002)
+
+    def run(self, data):
+        if data.get('spectrum') is None:
+            return
+        with self.fps:
+            active = data.batch('spectrum_level') >= self.config['MIN_VOLUME_THRESHOLD']
+            if active.any():
+                # Only the peaks count, the window's main lobe would smear every partial
+                # over the semitones around it
+                power = np.square(mono_spectra(data)[active, self.first_bin - 1:self.last_bin + 1])
+                peaks = (power[:, 1:-1] > power[:, :-2]) & (power[:, 1:-1] >= power[:, 2:])
+                chroma = np.where(peaks, power[:, 1:-1], 0.0).dot(self.chroma_map)
+                chroma /= np.maximum(chroma.max(axis=1, keepdims=True), 1e-9)
+                self.chord_chroma.update_many(chroma)
+                self.key_chroma.update_many(chroma)
+
+            chroma = self.chord_chroma.value
+            norm = np.linalg.norm(chroma)
+            if not norm:
+                return
+            np.copyto(data.buffer('chroma'), chroma)
+            match = self.chord_templates.dot(chroma) / norm
+            chord = int(np.argmax(match))
+            data['chord'] = harmony_name(chord, chord=True) if match[chord] >= self.MIN_CHORD_MATCH else None
+
+            key_chroma = self.key_chroma.value
+            if key_chroma.std() > 0:
+                key_chroma = (key_chroma - key_chroma.mean()) / key_chroma.std()
+                data['key'] = harmony_name(int(np.argmax(self.key_templates.dot(key_chroma))))
+
+
+class LoudnessProcessor(Processor):
+    """\
+    Running level and loudness of the raw input over the EBU R128 windows
+
+    The mean square of every frame is computed once, plain (averaged over the
+    channels) and K-weighted (ITU-R BS.1770, summed over the channels), and added to
+    a running mean for each of WINDOWS, so the cost per frame doesn't depend on how
+    long they are.  rms_<window> is in dBFS and loudness_<window> in LUFS, both
+    floored at FLOOR for silence.  Unlike the mel bins they don't follow the
+    automatic gain, so quiet passages and silence can be told apart.
+    """
+
+    CONSUMES = ('raw_channels',)
+    PRODUCES = ('rms_momentary', 'rms_short_term', 'loudness_momentary', 'loudness_short_term')
+
+    # Name and length in seconds
+    WINDOWS = (('momentary', 0.4), ('short_term', 3.0))
+    FLOOR = -120.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # scipy.signal takes longer to import than the rest of the processors together
+        from scipy.signal import sosfilt
+        self.sosfilt = sosfilt
+        self.fps = FPSCounter('Loudness Processor')
+        channels = self.config.get('INPUT_CHANNELS', 1)
+        self.sos = k_weighting(self.config['MIC_RATE'])
+        self.filter_state = np.zeros((len(self.sos), channels, 2))
+        # Name, plain and K-weighted running mean square
+        self.windows = []
+        for name, length in self.WINDOWS:
+            size = max(1, int(round(length * self.config['FPS'])))
+            self.windows.append((name, RunningMean(size), RunningMean(size)))
+
+    def _level(self, mean_square, offset=0.0):
+        if mean_square <= 0:
+            return self.FLOOR
+        return max(offset + 10 * np.log10(mean_square), self.FLOOR)
+
+    def run(self, data):
+        if data.get('raw_channels') is None:
+            return
+        with self.fps:
+            # Frames x channels x samples, int16 scale, filtered as one run per channel
+            frames = data.batch() / 2.0**15
+            samples = frames.transpose(1, 0, 2).reshape(frames.shape[1], -1)
+            weighted, self.filter_state = self.sosfilt(self.sos, samples, zi=self.filter_state)
+            weighted = np.square(weighted).reshape(frames.shape[1], len(frames), -1).mean(axis=2).sum(axis=0)
+            plain = np.square(frames).mean(axis=(1, 2))
+
+            for name, rms, loudness in self.windows:
+                data['rms_' + name] = float(self._level(rms.update(plain)))
+                data['loudness_' + name] = float(self._level(loudness.update(weighted), -0.691))
+
 
 class IdleProcessor(Processor):
+    """\
+    Tracks how long the audio has been idle (quiet) and dead (silent)
+
+    By default idle is when the average of the normalized mel bins drops below
+    IDLE_THRESHOLD, and dead when they're all zero.  With IDLE_LOUDNESS set (in LUFS),
+    idle is when the short-term loudness drops below it instead, and dead when the
+    momentary loudness drops below the EBU R128 absolute gate, which doesn't depend
+    on the gain.
+    """
+
+    CONSUMES = ('audio', 'loudness_momentary', 'loudness_short_term')
+    PRODUCES = ('audio_v_sum', 'audio_v_avg', 'idle_for', 'dead_for')
+
+    # LUFS
+    DEAD_LOUDNESS = -70.0
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fps = FPSCounter('Idle Processor')
@@ -152,14 +589,19 @@ class IdleProcessor(Processor):
         v_sum = np.sum(audio)
         v_avg = v_sum / len(audio)
         data.update({'audio_v_sum': v_sum, 'audio_v_avg': v_avg})
-        if v_avg < threshold:
+        idle, dead = v_avg < threshold, v_sum == 0
+        if self.config.get('IDLE_LOUDNESS') is not None and data.get('loudness_short_term') is not None:
+            idle = data['loudness_short_term'] < self.config['IDLE_LOUDNESS']
+            dead = data['loudness_momentary'] < self.DEAD_LOUDNESS
+
+        if idle:
             self.idle_since = self.idle_since or time.time()
             data['idle_for'] = time.time() - self.idle_since
         else:
             self.idle_since = None
             data['idle_for'] = None
 
-        if v_sum == 0:
+        if dead:
             self.dead_since = self.dead_since or time.time()
             data['dead_for'] = time.time() - self.dead_since
         else:
@@ -0,0 +1,56 @@
+import importlib
+
+
+# Name in the config: module.Class, imported when a config first uses it
+INPUTS = {
+    'PyAudio': 'app.inputs.PyAudioDeviceInput',
+    'Alsa': 'app.inputs.AlsaDeviceInput',
+    'File': 'app.inputs.FileDeviceInput',
+    'Network': 'app.inputs.NetworkDeviceInput',
+}
+
+PROCESSORS = {
+    'spectrum': 'app.processors.SpectrumProcessor',
+    'smoothing': 'app.processors.SmoothingProcessor',
+    'onset': 'app.processors.OnsetProcessor',
+    'beat': 'app.processors.BeatProcessor',
+    'pitch': 'app.processors.PitchProcessor',
+    'chroma': 'app.processors.ChromaProcessor',
+    'loudness': 'app.processors.LoudnessProcessor',
+    'idle': 'app.processors.IdleProcessor',
+}
+
+OUTPUTS = {
+    'UKingGobo': 'app.outputs.dmxfixtures.gobo.UKingGobo',
+    'UnnamedGobo': 'app.outputs.dmxfixtures.gobo.UnnamedGobo',
+    'TomshineMovingHead6in1': 'app.outputs.dmxfixtures.movinghead.TomshineMovingHead6in1',
+    'Generic4ColorLaser': 'app.outputs.dmxfixtures.laser.Generic4ColorLaser',
+    'RemoteStrip': 'app.outputs.led.RemoteStrip',
+}
+
+REGISTRY = {
+    'input': INPUTS,
+    'processor': PROCESSORS,
+    'output': OUTPUTS,
+}
+
+_loaded = {}
+
+
+def resolve(kind, name):
+    """\
+    Returns the class registered as name for kind (input, processor or output)
+
+    Only the module the class is in is imported, so the libraries of inputs, processors
+    and fixtures a config doesn't use are never loaded.  A name that isn't registered
+    can be given as module.Class, eg. a processor outside of this package.
+    """
+    path = REGISTRY[kind].get(name)
+    if path is None:
+        if '.' not in name:
+            raise ValueError(f"Invalid {kind} {name}, must be one of {', '.join(REGISTRY[kind])} or module.Class")
+        path = name
+    if path not in _loaded:
+        module, cls = path.rsplit('.', 1)
+        _loaded[path] = getattr(importlib.import_module(module), cls)
+    return _loaded[path]
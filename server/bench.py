@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""\
+Offline benchmark for the server pipeline
+
+Replays recorded (or generated) audio through the same tasks main.py builds, as fast
+as possible, with every output pointed at a sink: RemoteStrips send to a local UDP
+socket, DMX uses the sink device and the GUI is disabled.  Reports the overall frame
+rate and per-task throughput and latency percentiles.
+"""
+
+import argparse
+import logging
+import socket
+import time
+import wave
+
+import numpy as np
+
+from app.inputs import Input
+from app.lib.config import parse_config
+from app.lib.network import Network, NetworkTask
+from app.pipeline import build_pipeline
+from app.frame import FrameContext
+from main import build_tasks
+
+
+logger = logging.getLogger()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Audio reactive lights pipeline benchmark")
+    p.add_argument('-c', '--config', help="Configuration file")
+    p.add_argument('-a', '--audio', help="16 bit WAV file to replay (default: generated audio)")
+    p.add_argument('-n', '--frames', type=int, default=3000, help="Number of frames to measure")
+    p.add_argument('-w', '--warmup', type=int, default=100, help="Number of frames to run before measuring")
+    return p.parse_args()
+
+
+def load_audio(filename, rate):
+    """Load a 16 bit WAV file, downmixed to mono"""
+    with wave.open(filename, 'rb') as fp:
+        if fp.getsampwidth() != 2:
+            raise ValueError("Only 16 bit WAV files are supported")
+        if fp.getframerate() != rate:
+            logger.warning("%s is %d Hz but MIC_RATE is %d, replaying it anyway", filename, fp.getframerate(), rate)
+        samples = np.frombuffer(fp.readframes(fp.getnframes()), dtype=np.int16)
+        samples = samples.reshape(-1, fp.getnchannels()).mean(axis=1)
+    return samples.astype(np.int16)
+
+
+def generate_audio(rate, seconds=10):
+    """Noise, a chord and a kick every half second, so every processor has work to do"""
+    t = np.arange(int(rate * seconds)) / rate
+    samples = np.random.normal(0, 0.05, len(t))
+    for freq in (220, 277.18, 329.63):
+        samples += 0.15 * np.sin(2 * np.pi * freq * t)
+    kick = (t % 0.5) < 0.08
+    samples[kick] += 0.6 * np.sin(2 * np.pi * 60 * t[kick]) * np.exp(-(t[kick] % 0.5) * 40)
+    return (np.clip(samples, -1, 1) * (2**15 - 1)).astype(np.int16)
+
+
+class ReplayInput(Input):
+    """Loops over preloaded audio, one block per frame, without any pacing"""
+
+    PRODUCES = ('raw_channels', 'raw_audio', 'capture_time')
+
+    def __init__(self, name, config, samples, *args, **kwargs):
+        super().__init__(name, config, *args, **kwargs)
+        n_blocks = len(samples) // self.frames_per_buffer
+        if not n_blocks:
+            raise ValueError("Not enough audio for a single frame")
+        self.blocks = samples[:n_blocks * self.frames_per_buffer].reshape(n_blocks, self.frames_per_buffer)
+        self.position = 0
+
+    def run(self, data):
+        block = self.blocks[self.position % len(self.blocks)]
+        self.position += 1
+        data['capture_time'] = time.time()
+        # The same audio on every channel
+        np.copyto(data.buffer('raw_channels'), block)
+        self.downmix(data)
+
+
+def percentiles(samples):
+    samples = np.array(samples) * 1000
+    p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+    return samples.mean(), p50, p95, p99, samples.max()
+
+
+def bench(args):
+    config = parse_config(filename=args.config)
+
+    # Point every output at a sink
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    for output in config['OUTPUTS']:
+        if output['DEVICE'] == 'RemoteStrip':
+            output['HOST'], output['PORT'] = sink.getsockname()
+    if config.get('DMX_DEVICE'):
+        config['DMX_DEVICE'] = 'sink'
+    config['USE_GUI'] = False
+    config['NETWORK_HOST'] = '127.0.0.1'
+    config['NETWORK_PORT'] = 0
+
+    samples = load_audio(args.audio, config['MIC_RATE']) if args.audio else generate_audio(config['MIC_RATE'])
+    tasks, lights = build_tasks(config, audio_input=ReplayInput('replay', config, samples))
+    tasks = build_pipeline(tasks, config)
+    network = Network(config, lights)
+    tasks.insert(0, NetworkTask('netinput', config, network, 'input'))
+    tasks.append(NetworkTask('netoutput', config, network, 'output'))
+
+    timings = {t.name: [] for t in tasks}
+    frame_times = []
+    data = FrameContext(config)
+    try:
+        for t in tasks:
+            t.start(data)
+
+        for i in range(args.warmup + args.frames):
+            frame_start = time.perf_counter()
+            for t in tasks:
+                if not t.should_run(data):
+                    continue
+                start = time.perf_counter()
+                t.run(data)
+                if i >= args.warmup:
+                    timings[t.name].append(time.perf_counter() - start)
+            data.reset()
+            if i >= args.warmup:
+                frame_times.append(time.perf_counter() - frame_start)
+    finally:
+        for t in tasks:
+            t.stop()
+        sink.close()
+
+    elapsed = sum(frame_times)
+    budget = 1.0 / config['FPS']
+    print(f"\n{len(frame_times)} frames in {elapsed:.3f}s: {len(frame_times) / elapsed:.1f} FPS, "
+          f"{(len(frame_times) * budget) / elapsed:.1f}x real time at {config['FPS']} FPS")
+    print(f"{'task':<24} {'runs':>6} {'runs/s':>10} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for name, samples in list(timings.items()) + [('frame', frame_times)]:
+        if not samples:
+            print(f"{name:<24} {0:>6}")
+            continue
+        mean, p50, p95, p99, max_ = percentiles(samples)
+        print(f"{name:<24} {len(samples):>6} {1000 / mean:>10.1f} {mean:>8.3f} {p50:>8.3f} {p95:>8.3f} {p99:>8.3f} {max_:>8.3f}")
+
+
+if __name__ == '__main__':
+    bench(parse_args())
@@ -2,27 +2,33 @@
 
 import argparse
 import logging
-import multiprocessing
 import time
 import signal
 import os
 
 from app import NoData
-from app.lib.config import parse_config
+from app.lib.config import parse_config, diff_config, RUNTIME_KEYS
+from app.lib.clock import FrameClock
 from app.lib.network import Network, NetworkTask
-from app.inputs import PyAudioDeviceInput, AlsaDeviceInput
-from app.processors import SmoothingProcessor, BeatProcessor, PitchProcessor, IdleProcessor
-from app.outputs.dmxfixtures.gobo import UKingGobo, UnnamedGobo
-from app.outputs.dmxfixtures.movinghead import TomshineMovingHead6in1
-from app.outputs.dmxfixtures.laser import Generic4ColorLaser
-from app.outputs.led import RemoteStrip
-from app.outputs.gui import GUI
-from app.outputs.dmx import DMX
+from app.pipeline import build_pipeline, TaskGroup
+from app.frame import FrameContext
+from app.lib import latency
+from app.lib.supervisor import Heartbeat, TaskStalled
+from app.registry import resolve
 
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger()
 last_signal = None
+reload_requested = False
+
+# Tasks that run after the outputs, by name
+SINKS = ('gui', 'dmx')
+
+# Seconds before a crashed child is started again, see watch()
+RESTART_DELAY = 1.0
+RESTART_MAX_DELAY = 60.0
+RESTART_STABLE = 60.0
 
 
 def parse_args():
@@ -32,7 +38,8 @@ def parse_args():
     p.add_argument('-r', '--record', help="Record states to this file")
     p.add_argument('-M', '--monitor', action='store_true', help="Print monitor data (except audio) to the console")
     p.add_argument('-f', '--filter', action='append', help="Filter the monitor data")
-    p.add_argument('-w', '--watchdog', nargs='?', type=float, default=0, help="Watchdog - if the process hangs for this many seconds, restart it")
+    p.add_argument('-L', '--latency', action='store_true', help="Print mic-to-light latency percentiles per stage to the console")
+    p.add_argument('-w', '--watchdog', nargs='?', type=float, default=0, help="Watchdog - if a task hangs for this many seconds restart it, if that doesn't help restart the process")
     return p.parse_args()
 
 
@@ -43,60 +50,234 @@ def install_sighandler():
     signal.signal(signal.SIGINT, _sig_handler)
     signal.signal(signal.SIGTERM, _sig_handler)
 
+    def _reload_handler(signo, frame):
+        global reload_requested
+        reload_requested = True
+    signal.signal(signal.SIGHUP, _reload_handler)
 
-def run(args, watchdog=None):
-    config = parse_config(filename=args.config)
+
+def build_tasks(config, manual=None, record=None, audio_input=None):
+    """\
+    Create the tasks for a config, in the order they were declared
+
+    The first task is always the input.  audio_input replaces the configured audio
+    input (used by the benchmark).  The input, PROCESSORS and outputs are resolved
+    through app.registry, and the GUI and DMX are imported only if enabled, so only
+    the modules (and libraries) the config uses are loaded.  Returns the list of tasks
+    and the list of lights.
+    """
     lights = []
     config['ENABLE_LINKS'] = True
-    if args.manual:
+    if manual:
         config['ENABLE_LINKS'] = False
-        if args.record:
-            config['RECORD'] = args.record
-        if args.manual == 'launchpad':
+        if record:
+            config['RECORD'] = record
+        if manual == 'launchpad':
             from app.manualcontrol.novationlaunchpad import LaunchpadInput
             tasks = [LaunchpadInput('manual/launchpad', config)]
         else:
-            raise ValueError(f"Invalid manual control: {args.manual}")
+            raise ValueError(f"Invalid manual control: {manual}")
     else:
-        tasks = [
-            globals()[config.get('INPUT_TYPE', 'Alsa') + 'DeviceInput']('audioinput', config),
-            SmoothingProcessor('smoothing', config),
-            BeatProcessor('beat', config),
-            PitchProcessor('pitch', config),
-            IdleProcessor('idle', config),
-        ]
+        tasks = [audio_input or resolve('input', config.get('INPUT_TYPE', 'Alsa'))('audioinput', config)]
+        tasks += [resolve('processor', name)(name, config) for name in config['PROCESSORS']]
     for output in config['OUTPUTS']:
-        light = globals()[output['DEVICE']](config, output)
+        light = create_output(config, output)
         lights.append(light)
         tasks.append(light)
-        if args.manual:
+        if manual:
             tasks[0].add_output(tasks[-1])
-    if config['USE_GUI'] and not args.manual:
+    if config['USE_GUI'] and not manual:
+        from app.outputs.gui import GUI
         tasks.append(GUI('gui', config))
-    # Add DMX last so it gets called last
     if config.get('DMX_DEVICE'):
+        from app.outputs.dmx import DMX
         tasks.append(DMX('dmx', config))
+    return tasks, lights
+
+
+def create_output(config, output):
+    return resolve('output', output['DEVICE'])(config, output)
+
+
+def reload_config(args, config, tasks, lights, data):
+    """\
+    Reload the config file and apply what changed to the running tasks
+
+    The config dict is updated in place, every task holds a reference to it.  Outputs
+    are matched by name: outputs that changed only in RECONFIGURABLE keys (mappings,
+    links, effects) are updated in place, other changed outputs are recreated, and
+    outputs that are gone are stopped.  The input, processors and the network server
+    are kept, so filters keep their state and sockets stay open; processors are told
+    which settings changed.  Settings that need a restart keep their running value.
+
+    Every task checks the new config (check_config()) and the pipeline is built with
+    the new outputs before anything is changed.  If a task still fails to apply it,
+    the running config is put back and the tasks already told about the change are
+    told again, and the outputs are left alone.
+
+    tasks and lights are the lists returned by build_tasks, lights is updated in place.
+    Returns the new task list to build the pipeline from, or None if the config can't
+    be loaded.
+    """
+    try:
+        new_config = parse_config(filename=args.config)
+    except Exception:
+        logger.error("Can't reload the config, keeping the running config", exc_info=True)
+        return None
+
+    changed, restart = diff_config(config, new_config)
+    for key in sorted(restart):
+        logger.warning("%s changed, restart the server to apply it", key)
+        if key in config:
+            new_config[key] = config[key]
+        else:
+            del new_config[key]
+    changed -= restart
+    for key in RUNTIME_KEYS:
+        if key in config:
+            new_config[key] = config[key]
+
+    # Nothing is changed until every task accepts the new config, and the pipeline
+    # builds with the new outputs (created here only to check them, never started)
+    try:
+        for t in tasks:
+            t.check_config(new_config, changed)
+        build_pipeline([t for t in tasks if t not in lights] + [create_output(new_config, o) for o in new_config['OUTPUTS']], new_config)
+    except Exception:
+        logger.error("Can't apply the reloaded config, keeping the running config", exc_info=True)
+        return None
+
+    old_config = dict(config)
+    config.clear()
+    config.update(new_config)
+    others = [t for t in tasks if t not in lights]
+    if changed:
+        logger.info("Changed settings: %s", ', '.join(sorted(changed)))
+        notified = []
+        try:
+            for t in others:
+                notified.append(t)
+                t.config_changed(changed)
+        except Exception:
+            logger.error("Can't apply the reloaded config, going back to the running config", exc_info=True)
+            config.clear()
+            config.update(old_config)
+            for t in notified:
+                try:
+                    t.config_changed(changed)
+                except Exception:
+                    logger.error("Task %s failed to go back to the running config", t.name, exc_info=True)
+            return None
+
+    current = {l.name: l for l in lights}
+    new_lights = []
+    for output in config['OUTPUTS']:
+        light = current.pop(output['NAME'], None)
+        if light is None or not light.reconfigure(output):
+            if light is not None:
+                light.stop()
+            logger.info("%s output %s", 'Creating' if light is None else 'Recreating', output['NAME'])
+            light = create_output(config, output)
+            light.start(data)
+            if args.manual:
+                tasks[0].add_output(light)
+        new_lights.append(light)
+    for light in current.values():
+        logger.info("Removing output %s", light.name)
+        light.stop()
+
+    dmx = next((t for t in others if t.name == 'dmx'), None)
+    if dmx and not config.get('DMX_DEVICE'):
+        dmx.stop()
+        others.remove(dmx)
+    elif dmx and 'DMX_DEVICE' in changed:
+        # Reopens the device from the new config on the next frame
+        dmx.restart(data)
+    elif not dmx and config.get('DMX_DEVICE'):
+        from app.outputs.dmx import DMX
+        dmx = DMX('dmx', config)
+        dmx.start(data)
+        others.append(dmx)
+
+    lights[:] = new_lights
+    if changed:
+        for t in lights:
+            t.config_changed(changed)
+    return [t for t in others if t.name not in SINKS] + lights + [t for t in others if t.name in SINKS]
+
+
+def run(args, heartbeat=None):
+    global reload_requested
+    config = parse_config(filename=args.config)
+    latency.tracker.print_reports = args.latency
+    flat_tasks, lights = build_tasks(config, manual=args.manual, record=args.record)
+
+    # The first task is always the input, it drives the clock
+    audio_input = flat_tasks[0]
+    clock = FrameClock('Main loop', config['FPS'], waiter=audio_input.wait)
+    tasks = build_pipeline(flat_tasks, config)
 
     network = Network(config, lights, monitor=args.monitor, monitor_filter=args.filter)
-    tasks.insert(0, NetworkTask('netinput', config, network, 'input'))
-    tasks.append(NetworkTask('netoutput', config, network, 'output'))
+    netinput = NetworkTask('netinput', config, network, 'input')
+    netoutput = NetworkTask('netoutput', config, network, 'output')
+    tasks = [netinput] + tasks + [netoutput]
 
     try:
         install_sighandler()
-        data = {'network': network}
+        if heartbeat:
+            heartbeat.install_handler()
+        # Anything written during start is sent with the first frame
+        data = FrameContext(config)
         for t in tasks:
             t.start(data)
 
         while last_signal is None:
-            data = {}
-            for t in tasks:
-                try:
-                    t.run(data)
-                except NoData:
-                    break
+            if reload_requested or network.reload_requested:
+                reload_requested = network.reload_requested = False
+                logger.info("Reloading config")
+                if heartbeat:
+                    # Like startup, the supervisor only kills the child if this hangs
+                    heartbeat.beat(Heartbeat.STARTING)
+                reloaded = reload_config(args, config, flat_tasks, lights, data)
+                if reloaded is not None:
+                    for t in tasks:
+                        if isinstance(t, TaskGroup):
+                            t.stop_pool()
+                    flat_tasks = reloaded
+                    tasks = [netinput] + build_pipeline(flat_tasks, config) + [netoutput]
+                    for t in tasks:
+                        if isinstance(t, TaskGroup):
+                            t.start_pool()
+                    network.lights = lights
 
-            if watchdog:
-                watchdog.value = time.time()
+            try:
+                if heartbeat:
+                    heartbeat.armed = True
+                    heartbeat.beat(Heartbeat.IDLE)
+                clock.wait()
+                with clock:
+                    for i, t in enumerate(tasks):
+                        if not t.should_run(data):
+                            continue
+                        if heartbeat:
+                            heartbeat.beat(i)
+                        try:
+                            t.run(data)
+                        except NoData:
+                            clock.mark_empty()
+                            break
+                        latency.record_latency(t.name, data)
+                if heartbeat:
+                    heartbeat.armed = False
+            except TaskStalled as e:
+                # Stuck while waiting for the next frame means stuck on the input
+                stalled = audio_input if e.index == Heartbeat.IDLE else tasks[e.index]
+                logger.error("Task %s is not responding, restarting it", stalled.name)
+                stalled.restart(data)
+            finally:
+                if heartbeat:
+                    heartbeat.armed = False
+                data.reset()
 
         logger.info("Exiting with signal %d", last_signal)
     finally:
@@ -104,43 +285,102 @@ def run(args, watchdog=None):
             t.stop()
 
 
-def run_watchdog(args):
-    watchdog = multiprocessing.Value('d', time.time() + 1)
+def supervise(args):
+    """\
+    Run the server in a child process and watch its heartbeat
+
+    If a task has been running for longer than the watchdog timeout, the child is asked
+    to restart just that task.  If it is still stuck after another timeout, the child
+    is killed.  Returns True if the child should be started again.
+    """
+    heartbeat = Heartbeat()
     pid = os.fork()
     if pid == 0:
-        run(args, watchdog=watchdog)
-    else:
-        install_sighandler()
-        while last_signal is None:
-            if time.time() - watchdog.value >= args.watchdog:
-                logger.error("Child is not responding, killing")
-                os.kill(pid, signal.SIGKILL)
+        run(args, heartbeat=heartbeat)
+        return False
+
+    global reload_requested
+    install_sighandler()
+    interval = min(args.watchdog / 4.0, 0.25)
+    escalate_at = None
+    while last_signal is None:
+        if reload_requested:
+            reload_requested = False
+            os.kill(pid, signal.SIGHUP)
+
+        res = os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG)
+        if res is not None:
+            if res.si_code != os.CLD_EXITED:
+                logger.error("Child was killed by signal %d, restarting", res.si_status)
+                return True
+            if res.si_status != 0:
+                logger.error("Child exited with status %d, restarting", res.si_status)
                 return True
+            return False
 
-            res = os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG)
-            if res is not None:
-                if res.si_code !=0:
-                    logger.error("Child exited with code %d, restarting", res.si_code)
-                    return True
-
-        logger.info("Killing child with signal %d", last_signal)
-        os.kill(pid, last_signal)
-        s = time.time()
-        while time.time() - s < 1:
-            res = os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG)
-            if res is not None:
-                break
-        if res is None:
-            logger.error("Killing child")
+        index, stalled_for = heartbeat.stalled()
+        if stalled_for < args.watchdog:
+            escalate_at = None
+        elif escalate_at is None and index == Heartbeat.STARTING:
+            # Nothing to restart yet
+            logger.warning("Child has not started after %fs", stalled_for)
+            escalate_at = time.time() + args.watchdog
+        elif escalate_at is None:
+            logger.warning("Task %d has not responded for %fs, asking the child to restart it", index, stalled_for)
+            heartbeat.request_restart(pid, index)
+            escalate_at = time.time() + args.watchdog
+        elif time.time() >= escalate_at:
+            logger.error("Child is not responding, killing")
             os.kill(pid, signal.SIGKILL)
+            os.waitid(os.P_PID, pid, os.WEXITED)
+            return True
+
+        time.sleep(interval)
+
+    logger.info("Killing child with signal %d", last_signal)
+    os.kill(pid, last_signal)
+    s = time.time()
+    while time.time() - s < 1:
+        res = os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG)
+        if res is not None:
+            break
+        time.sleep(0.05)
+    if res is None:
+        logger.error("Killing child")
+        os.kill(pid, signal.SIGKILL)
+
+
+def watch(args):
+    """\
+    Keep a supervised server running
+
+    A child that dies within RESTART_STABLE seconds of starting (eg. on a config that
+    fails at startup) is restarted after a delay that doubles every time, up to
+    RESTART_MAX_DELAY, instead of in a tight loop.  A child that ran for longer resets
+    the delay.
+    """
+    delay = RESTART_DELAY
+    while True:
+        started = time.time()
+        if not supervise(args):
+            return
+        if time.time() - started >= RESTART_STABLE:
+            delay = RESTART_DELAY
+        logger.info("Restarting in %fs", delay)
+        until = time.time() + delay
+        while last_signal is None and time.time() < until:
+            time.sleep(0.1)
+        if last_signal is not None:
+            logger.info("Exiting with signal %d", last_signal)
+            return
+        delay = min(delay * 2, RESTART_MAX_DELAY)
 
 
 if __name__ == '__main__':
     args = parse_args()
     if args.watchdog:
         logger.info("Starting up with watchdog timer %fs", args.watchdog)
-        while run_watchdog(args):
-            pass
+        watch(args)
     else:
         logger.info("Starting up with no watchdog timer")
         run(args)
\ No newline at end of file
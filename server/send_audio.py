@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""\
+Send audio to a server running the Network input
+
+Reads 16 bit PCM from a WAV file, or raw S16_LE from stdin, and sends it in
+sequenced packets over UDP or TCP, eg. from the mixer's machine:
+
+    arecord -f S16_LE -r 44100 -c 1 -t raw | ./send_audio.py udp://lights:37738
+
+WAV files are sent at the rate they would play at, stdin as fast as it is read.
+"""
+
+import argparse
+import socket
+import struct
+import sys
+import time
+import wave
+from urllib.parse import urlparse
+
+
+# Sequence number and payload size, see NetworkDeviceInput
+HEADER = struct.Struct('!II')
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Send audio to a light server's network input")
+    p.add_argument('destination', help="udp://host:port or tcp://host:port")
+    p.add_argument('-i', '--input', default='-', help="16 bit WAV file, or - for raw S16_LE on stdin (default)")
+    p.add_argument('-r', '--rate', type=int, default=44100, help="Sample rate of raw input")
+    p.add_argument('-c', '--channels', type=int, default=1, help="Channels of raw input")
+    p.add_argument('-p', '--packet', type=int, default=256, help="Frames per packet")
+    p.add_argument('-l', '--loop', action='store_true', help="Restart the WAV file when it ends")
+    return p.parse_args()
+
+
+def open_input(args):
+    """Returns a function reading n frames, the frame size in bytes and the rate to pace at (None for stdin)"""
+    if args.input == '-':
+        return lambda n: sys.stdin.buffer.read(n * 2 * args.channels), 2 * args.channels, None
+    wav = wave.open(args.input, 'rb')
+    if wav.getsampwidth() != 2:
+        raise ValueError("Only 16 bit WAV files are supported")
+
+    def _read(n):
+        frames = wav.readframes(n)
+        if len(frames) < n * 2 * wav.getnchannels() and args.loop:
+            wav.rewind()
+            frames += wav.readframes(n - len(frames) // (2 * wav.getnchannels()))
+        return frames
+    return _read, 2 * wav.getnchannels(), wav.getframerate()
+
+
+def send(args):
+    url = urlparse(args.destination)
+    if url.scheme not in ('udp', 'tcp') or not url.hostname:
+        raise ValueError("Destination must be udp://host:port or tcp://host:port")
+    address = (url.hostname, url.port or 37738)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if url.scheme == 'udp' else socket.SOCK_STREAM)
+    if url.scheme == 'tcp':
+        sock.connect(address)
+
+    read, frame_size, rate = open_input(args)
+    seq = 0
+    next_due = time.time()
+    while True:
+        payload = read(args.packet)
+        if len(payload) < args.packet * frame_size:
+            break
+        message = HEADER.pack(seq & 0xffffffff, len(payload)) + payload
+        if url.scheme == 'udp':
+            sock.sendto(message, address)
+        else:
+            sock.sendall(message)
+        seq += 1
+        if rate:
+            next_due += args.packet / float(rate)
+            time.sleep(max(0.0, next_due - time.time()))
+    sock.close()
+
+
+if __name__ == '__main__':
+    send(parse_args())